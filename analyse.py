@@ -24,18 +24,35 @@
 """Analyses survey responses.
 
 This module analyses survey responses in an excel .xlsx file through various
-data analysis methods.
+data analysis methods. docx and wordcloud are only imported once a report
+or word cloud is first generated, unless warm_up() imports them ahead.
 """
 
 # Imports
 import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from hashlib import sha256
+from importlib.util import find_spec
+from math import log, sqrt
+from operator import itemgetter
+from statistics import NormalDist
 
-from docx import Document
-from numpy import mean, median
-from scipy.stats import mode
-from wordcloud import WordCloud
+import numpy
 
-from utils import parse_config, parse_excel, secure, random_colour, parse_csv
+import metrics
+from survey import Column, NumericalColumn, encode
+from utils import CHUNK_SIZE, get_predictor, parse_config, load_survey, secure, random_colour
+
+FONT = "./static/fonts/Nunito-Regular.ttf"
+WORD = re.compile(r"\w[\w']*")
+SAMPLE_SIZE = 10000
+TOP_CATEGORIES = 12
+CONFIDENCE = 0.95
+WORDS = 200
 
 
 def categorise(responses, datatypes):
@@ -43,7 +60,8 @@ def categorise(responses, datatypes):
     the responses and the responses
 
     Args:
-        responses(dict): The responses(tuple/list) mapped to their question
+        responses(dict/Survey): The responses(tuple/list/Column) mapped to
+            their question
         datatypes(dict): The datatypes of the responses
             mapped to question number
 
@@ -55,17 +73,22 @@ def categorise(responses, datatypes):
     >>> categorise({"Question 1": ("Answer 1", "Answer 2")}, {1: "categorical"})
     {'Question 1': ('categorical', ('Answer 1', 'Answer 2'))}
     """
+    numbers = getattr(responses, "numbers", None)
     output = {}
     for i, items in enumerate(responses.items()):
-        output[items[0]] = tuple([datatypes[i + 1], items[1]])
+        number = numbers[items[0]] if numbers else i + 1
+        output[items[0]] = tuple([datatypes[number], items[1]])
     return output
 
 
 def multi_categorical(responses):
     """Analyses multi-categorical responses
 
+    Each distinct response is only split once, and its options are
+    counted as many times as the response was given.
+
     Args:
-        responses(list/tuple): list/tuple of the responses
+        responses(list/tuple/Column): list/tuple of the responses
             For example: ["Good aesthetics;Intuitive UI","Good aesthetics;Intuitive UI;Free software"]
             or ("Good aesthetics;Intuitive UI","Good aesthetics;Intuitive UI;Free software")
 
@@ -74,86 +97,730 @@ def multi_categorical(responses):
         For example:
         {"Percentages": {"Free software": 0.2, "Good aesthetics": 0.4, "Intuitive UI": 0.4}}
     """
-    separated_responses = []
-    for response in responses:
-        for option in response.split(";"):
-            separated_responses.append(option)
-    return categorical(separated_responses)
+    return counter_percentages(options(responses))
+
+
+def options(responses):
+    """Counts the options chosen in multi-categorical responses
+
+    Args:
+        responses(list/tuple/Column): list/tuple of the responses
+            For example: ["Good aesthetics;Intuitive UI","Good aesthetics"]
+
+    Returns:
+        A Counter mapping each option to the number of times it was chosen,
+        in the order in which the options first appear
+
+    >>> options(["Good aesthetics;Intuitive UI", "Good aesthetics"])
+    Counter({'Good aesthetics': 2, 'Intuitive UI': 1})
+    """
+    labels, counts = count(responses)
+    chosen = Counter()
+    for label, freq in zip(labels, counts.tolist()):
+        if freq:
+            for option in label.split(";"):
+                chosen[option] += freq
+    return chosen
 
 
-def numerical(responses):
+def numerical(responses, bins=10):
     """Analyses numerical responses
 
+    The responses are counted once, and every statistic is then derived
+    from the distinct values and their counts.
+
     Args:
-        responses(list/tuple): List/tuple of the responses
+        responses(list/tuple/numpy.ndarray): List/tuple of the responses
             For example: [1,2,3,1,2,3,4,58,1,5,8] or
             (1,2,3,1,2,3,4,58,1,5,8)
+        bins(int): Number of bins in the histogram
 
     Returns:
-        A dict of the Mean, Median and Mode of the data.
+        A dict of the Mean, Median and Mode of the data, along with its
+        Standard deviation, Minimum, Maximum, Quartiles and Histogram.
         If there are multiple modes, the smallest mode is given.
         For example:
-        {"Mean": 8.0, "Median": 3.0, "Mode": [1]}
+        {"Mean": 8.0, "Median": 3.0, "Mode": [1], "Standard deviation": 15.9, ...}
+
+    >>> stats = numerical([1, 2, 3, 1, 2, 3, 4, 58, 1, 5, 8])
+    >>> stats["Mean"], stats["Median"], stats["Mode"], stats["Quartiles"]
+    (8.0, 3.0, [1], [1.5, 3.0, 4.5])
     """
-    central_tendencies = {
-        "Mean": mean(responses),
-        "Median": median(responses),
-        "Mode": mode(responses)[0].tolist(),
+    return describe(*value_counts(responses), bins=bins)
+
+
+def value_counts(responses):
+    """Counts the occurrences of each distinct numerical response
+
+    Integers within a small range are counted with a single bincount, and
+    any other values are counted after sorting them.
+
+    Args:
+        responses(list/tuple/numpy.ndarray): List/tuple of the responses
+            For example: [1,2,3,1,2,3,4,58,1,5,8]
+
+    Returns:
+        A tuple containing a sorted array of the distinct values and an
+        array of their counts.
+
+    >>> [array.tolist() for array in value_counts([3, 1, 3])]
+    [[1, 3], [1, 2]]
+    """
+    values = numpy.asarray(responses)
+    if values.size and numpy.issubdtype(values.dtype, numpy.integer):
+        smallest = values.min()
+        span = int(values.max()) - int(smallest)
+        if span <= max(4 * values.size, 1024):
+            counts = numpy.bincount(values - smallest, minlength=span + 1)
+            present = numpy.flatnonzero(counts)
+            return present + smallest, counts[present]
+    return numpy.unique(values, return_counts=True)
+
+
+def describe(values, counts, bins=10):
+    """Calculates descriptive statistics from value counts
+
+    Args:
+        values(numpy.ndarray): The sorted distinct values
+        counts(numpy.ndarray): The number of occurrences of each value
+        bins(int): Number of bins in the histogram
+
+    Returns:
+        A dict of the statistics, see numerical()
+    """
+    total = int(counts.sum())
+    if not total:
+        nan = float("nan")
+        return {"Mean": nan, "Median": nan, "Mode": [], "Standard deviation": nan,
+                "Minimum": nan, "Maximum": nan, "Quartiles": [nan, nan, nan],
+                "Histogram": {"Counts": [], "Edges": []}}
+    weights = counts.astype(numpy.float64)
+    mean = float(numpy.dot(values, weights) / total)
+    variance = float(numpy.dot((values - mean) ** 2, weights) / total)
+    cumulative = numpy.cumsum(counts)
+
+    def quantile(q):
+        position = (total - 1) * q
+        lower, upper = numpy.searchsorted(
+            cumulative, [int(position), min(int(position) + 1, total - 1)], side="right"
+        )
+        return float(values[lower] + (position - int(position)) * (values[upper] - values[lower]))
+
+    histogram, edges = numpy.histogram(values, bins=bins, weights=counts)
+    return {
+        "Mean": mean,
+        "Median": quantile(0.5),
+        "Mode": [values[numpy.argmax(counts)].item()],
+        "Standard deviation": variance ** 0.5,
+        "Minimum": values[0].item(),
+        "Maximum": values[-1].item(),
+        "Quartiles": [quantile(0.25), quantile(0.5), quantile(0.75)],
+        "Histogram": {"Counts": histogram.astype(numpy.int64).tolist(), "Edges": edges.tolist()},
     }
-    return central_tendencies
 
 
 def categorical(responses):
     """Analyses categorical responses
 
     Args:
-        responses(list/tuple): List/tuple of the responses
+        responses(list/tuple/Column): List/tuple of the responses
             For example: ["Yes","No","Yes"] or ("Yes","No","Yes")
 
     Returns:
         A dictionary containing the sorted percentages of each response.
         For example:
         {"Percentages": {"No": 0.3333333333333333, "Yes": 0.6666666666666666}}
+
+    >>> categorical(["Yes", "No", "Yes"])
+    {'Percentages': {'No': 0.3333333333333333, 'Yes': 0.6666666666666666}}
+    """
+    return percentages(*count(responses))
+
+
+def count(responses):
+    """Counts the occurrences of each distinct response
+
+    Responses are dictionary-encoded first if they are not already a
+    Column, and the codes are then counted in a single pass.
+
+    Args:
+        responses(list/tuple/Column): List/tuple of the responses
+            For example: ["Yes","No","Yes"] or ("Yes","No","Yes")
+
+    Returns:
+        A tuple containing the distinct responses, in the order in which
+        they first appear, and an array of their counts.
+        For example:
+        (("Yes", "No"), array([2, 1]))
+    """
+    if not isinstance(responses, Column):
+        responses = encode(responses)
+    return responses.labels, responses.counts()
+
+
+def percentages(labels, counts):
+    """Converts counts into sorted percentages
+
+    Args:
+        labels(list/tuple): The distinct responses
+        counts(numpy.ndarray): The number of occurrences of each response
+
+    Returns:
+        A dictionary containing the percentages of each response, sorted
+        from smallest to largest. Responses with equal percentages keep
+        their original order.
+        For example:
+        {"Percentages": {"No": 0.3333333333333333, "Yes": 0.6666666666666666}}
+    """
+    present = numpy.flatnonzero(counts)
+    order = present[numpy.argsort(counts[present], kind="stable")]
+    shares = (counts[order] / counts.sum()).tolist()
+    return {"Percentages": dict(zip([labels[i] for i in order.tolist()], shares))}
+
+
+def counter_percentages(counter):
+    """Converts a Counter into sorted percentages, see percentages()"""
+    return percentages(list(counter), numpy.fromiter(counter.values(), numpy.int64, len(counter)))
+
+
+def term_frequencies(responses):
+    """Counts the words in openended responses
+
+    Each distinct response is only split into words once, and its words
+    are counted as many times as the response was given. Stopwords and
+    numbers are left out, like wordcloud does. Words are counted as they
+    are written, so that counts can still be added up, and their cases
+    and plurals are only merged by fuse_words().
+
+    Args:
+        responses(list/tuple/Column): List/tuple of responses
+            For example: ["Nil","The duration","Microbit"] or
+            ("Nil","The duration","Microbit")
+
+    Returns:
+        A Counter mapping each word to the number of times it was used
+
+    >>> term_frequencies(["The durations", "Microbit's duration"])
+    Counter({'durations': 1, 'Microbit': 1, 'duration': 1})
+    """
+    labels, counts = count(responses)
+    frequencies = Counter()
+    excluded = stopwords()
+    for label, freq in zip(labels, counts.tolist()):
+        for word in WORD.findall(label):
+            if word.lower().endswith("'s"):
+                word = word[:-2]
+            if word.lower() not in excluded and not word.isdigit():
+                frequencies[word] += freq
+    return frequencies
+
+
+def fuse_words(counts):
+    """Merges the cases and plurals of words, like wordcloud does
+
+    Every word is shown in its most common case, and a word ending in "s"
+    is counted as the same word without the "s", if that word is also
+    used. This is wordcloud.tokenization.process_tokens(), but from the
+    number of times each word was used instead of from every use.
+
+    Args:
+        counts(Counter): The number of times each word was used,
+            from term_frequencies()
+
+    Returns:
+        A Counter mapping each merged word to the number of times it was used
+
+    >>> fuse_words(Counter({"Microbit": 2, "microbit": 1, "projects": 2, "project": 1}))
+    Counter({'Microbit': 3, 'project': 3})
     """
-    categories = {}
-    for i in responses:
-        if i not in categories.keys():
-            categories[i] = 1
-        else:
-            categories[i] += 1
+    cases = {}
+    for word, frequency in counts.items():
+        variants = cases.setdefault(word.lower(), {})
+        variants[word] = variants.get(word, 0) + frequency
+    for word in list(cases):
+        if word.endswith("s") and not word.endswith("ss") and word[:-1] in cases:
+            singular = cases[word[:-1]]
+            for variant, frequency in cases.pop(word).items():
+                singular[variant[:-1]] = singular.get(variant[:-1], 0) + frequency
+    return Counter(
+        {max(variants.items(), key=itemgetter(1))[0]: sum(variants.values()) for variants in cases.values()}
+    )
+
 
-    for category, freq in categories.items():
-        categories[category] = freq / len(responses)
-    sorting = sorted(categories.items(), key=lambda x: x[1])
-    return {"Percentages": dict(sorting)}
+@lru_cache(maxsize=None)
+def stopwords():
+    """Returns the stopwords of wordcloud
+
+    They are read from the wordcloud package without importing it, as
+    importing it also imports matplotlib, which is only needed to render
+    word clouds.
+
+    Returns:
+        A frozenset of the stopwords
+    """
+    package = find_spec("wordcloud").submodule_search_locations[0]
+    with open(os.path.join(package, "stopwords"), "r", encoding="utf-8") as f:
+        return frozenset(map(str.strip, f.readlines()))
 
 
-def openended(responses, directory):
+def renderer(width, height):
+    """Returns a word cloud renderer for an image size
+
+    A renderer is created for every word cloud, as creating one is cheap
+    and renderers can not be shared between threads.
+
+    Args:
+        width(int): Width of the word cloud in pixels
+        height(int): Height of the word cloud in pixels
+
+    Returns:
+        A WordCloud
+    """
+    from wordcloud import WordCloud
+
+    return WordCloud(font_path=FONT, background_color="white", color_func=random_colour,
+                     width=width, height=height)
+
+
+def warm_up():
+    """Imports and loads everything that is otherwise only loaded on first use
+
+    Called before the first request, such as before a server forks its
+    workers, so that no request pays for importing docx, openpyxl and
+    wordcloud, for reading the stopwords or for loading the predictor.
+    Workers forked afterwards share all of it with the server. Fonts are
+    not kept, as wordcloud loads them again for every word cloud.
+    """
+    import docx  # noqa: F401
+    import openpyxl  # noqa: F401
+    import wordcloud  # noqa: F401
+
+    stopwords()
+    get_predictor()
+
+
+def openended(responses, directory, width=400, height=200, compress_level=6):
     """Analyses openended responses
 
     Args:
-        responses(list/tuple): List/tuple of responses
+        responses(list/tuple/Column): List/tuple of responses
             For example: ["Nil","The duration","Microbit"] or
             ("Nil","The duration","Microbit")
         directory(str): path to the folder containing the excel file and config file
             For example: "./static/uploads/4SikvVjjqlWV44AW/"
+        width(int): Width of the word cloud in pixels
+        height(int): Height of the word cloud in pixels
+        compress_level(int): PNG compression level of the word cloud, from 0 to 9
 
     Returns:
         A string that is the path to the wordcloud generated from the responses
             For example: "./static/uploads/4SikvVjjqlWV44AW/zxmVHMV1QlAvYFq3.png"
     """
-    text = " ".join(responses)
-    cloud = WordCloud(font_path="./static/fonts/Nunito-Regular.ttf", background_color="white",
-                      color_func=random_colour).generate(text)
-    image = cloud.to_image()
+    return render_cloud(fuse_words(term_frequencies(responses)), directory, width, height, compress_level)
+
+
+def render_cloud(frequencies, directory, width=400, height=200, compress_level=6):
+    """Renders a word cloud from term frequencies, see openended()
+
+    Args:
+        frequencies(Counter): The number of times each word was used,
+            from term_frequencies()
+        directory(str): path to the folder to save the word cloud in
+
+    Returns:
+        A string that is the path to the wordcloud
+    """
+    image = renderer(width, height).generate_from_frequencies(frequencies).to_image()
     path = os.path.join(directory, f"{secure(16)}.png")
-    image.save(path)
+    image.save(path, compress_level=compress_level)
     return path
 
 
-def analyse(directory, survey_file, config_file):
+def cloud_path(directory, number, result):
+    """Returns the path to the word cloud of a question rendered by cloud()
+
+    The path depends on the words of the cloud, so that the cloud of an
+    analysis is not overwritten by that of the analysis merged from it.
+    """
+    digest = sha256(repr(sorted(result["Frequencies"].items())).encode("utf-8")).hexdigest()
+    return os.path.join(directory, f"cloud_{number}_{digest[:16]}.png")
+
+
+def cloud(directory, result, number):
+    """Renders the word cloud of an openended analysis that only kept its words
+
+    The word cloud is only rendered once, and is then read back from
+    cloud_path().
+
+    Args:
+        directory(str): path to the folder to save the word cloud in
+        result(dict): the most common words of the responses, from terms()
+        number(int): the number of the question
+
+    Returns:
+        A string that is the path to the wordcloud
+    """
+    path = cloud_path(directory, number, result)
+    if not os.path.exists(path):
+        os.replace(render_cloud(result["Frequencies"], directory), path)
+    return path
+
+
+def terms(counts, words=WORDS):
+    """Keeps the most common words of openended responses
+
+    Used instead of a word cloud when the word cloud is not rendered. As
+    many words are kept as a word cloud shows.
+
+    Args:
+        counts(Counter): The number of times each word was used,
+            from term_frequencies()
+        words(int): The number of words to keep
+
+    Returns:
+        A dictionary containing the number of times each word was used,
+        from the most to the least common
+        For example:
+        {"Frequencies": {"duration": 2, "microbit": 1}}
+
+    >>> terms(Counter({"duration": 2, "microbit": 1, "nil": 1}), 2)
+    {'Frequencies': {'duration': 2, 'microbit': 1}}
+    """
+    return {"Frequencies": dict(counts.most_common(words))}
+
+
+def aggregate(category, responses):
+    """Counts the responses to a question
+
+    The counts of two sets of responses to a question add up to the
+    counts of all of their responses, so new responses can be folded into
+    an analysis without reading the old responses again, see merge().
+
+    Args:
+        category(str): datatype of the responses
+            For example: "categorical"
+        responses(list/tuple/Column/NumericalColumn): the responses to the question
+
+    Returns:
+        A Counter mapping each response (categorical), option
+        (multicategorical), value (numerical) or word (openended) to the
+        number of times it occurs, or None if the question is ignored.
+
+    >>> aggregate("categorical", ["Yes", "No", "Yes"])
+    Counter({'Yes': 2, 'No': 1})
+    >>> aggregate("numerical", [3, 1, 3])
+    Counter({3: 2, 1: 1})
+    """
+    if category == "numerical":
+        values, counts = value_counts(getattr(responses, "values", responses))
+        return Counter(dict(zip(values.tolist(), counts.tolist())))
+    elif category == "multicategorical":
+        return options(responses)
+    elif category == "categorical":
+        labels, counts = count(responses)
+        return Counter(dict(zip(labels, counts.tolist())))
+    elif category == "openended":
+        return term_frequencies(responses)
+    return None
+
+
+def summarise(category, counts, directory, clouds=True):
+    """Analyses a question from the counts of its responses
+
+    Args:
+        category(str): datatype of the responses
+            For example: "categorical"
+        counts(Counter): the counts of the responses, from aggregate()
+        directory(str): path to the folder containing the excel file and config file
+            For example: "./static/uploads/4SikvVjjqlWV44AW/"
+        clouds(bool): whether to render the word cloud of openended
+            responses, or only keep their most common words, see terms()
+
+    Returns:
+        A tuple containing the type of analysis and the analysis of the
+        responses, or None if the question is ignored.
+        For example:
+        ("categorical", {"Percentages": {"No": 0.5, "Yes": 0.5}})
+
+    >>> summarise("categorical", aggregate("categorical", ["Yes", "No", "Yes"]), ".")
+    ('categorical', {'Percentages': {'No': 0.3333333333333333, 'Yes': 0.6666666666666666}})
+    """
+    if category == "numerical":
+        values = numpy.array(sorted(counts), dtype=numpy.int64)
+        return "numerical", describe(
+            values, numpy.fromiter((counts[value] for value in values.tolist()), numpy.int64, len(values))
+        )
+    elif category in ("multicategorical", "categorical"):
+        return "categorical", counter_percentages(counts)
+    elif category == "openended":
+        words = fuse_words(counts)
+        return "openended", render_cloud(words, directory) if clouds else terms(words)
+    return None
+
+
+def analyse_question(category, responses, directory, clouds=True):
+    """Analyses the responses to a single question
+
+    Args:
+        category(str): datatype of the responses
+            For example: "categorical"
+        responses(list/tuple/Column): the responses to the question
+        directory(str): path to the folder containing the excel file and config file
+            For example: "./static/uploads/4SikvVjjqlWV44AW/"
+        clouds(bool): whether to render word clouds, see summarise()
+
+    Returns:
+        A tuple containing the analysis of the responses and their counts
+        from aggregate(). The analysis is a tuple containing the type of
+        analysis and the analysis of the responses, or None if the
+        question is ignored.
+        For example:
+        (("categorical", {"Percentages": {"No": 0.5, "Yes": 0.5}}), Counter({"Yes": 1, "No": 1}))
+    """
+    counts = aggregate(category, responses)
+    if counts is None:
+        return None, None
+    return summarise(category, counts, directory, clouds), counts
+
+
+def sample(responses, size, seed=0):
+    """Draws a uniform random sample of responses
+
+    Responses are drawn with replacement, so drawing them takes the same
+    time however many responses there are. A sampled Column only keeps
+    the labels of the sampled responses.
+
+    Args:
+        responses(list/tuple/Column/NumericalColumn): the responses
+        size(int): the number of responses to draw
+        seed(int): seed of the random generator, so that the same
+            responses always give the same sample
+
+    Returns:
+        The sampled responses, of the same type as responses
+
+    >>> len(sample(encode(["Yes", "No"] * 50), 10))
+    10
+    """
+    drawn = numpy.random.default_rng(seed).integers(0, len(responses), size)
+    if isinstance(responses, Column):
+        present, codes = numpy.unique(responses.codes[drawn], return_inverse=True)
+        return Column(codes, [responses.labels[code] for code in present.tolist()])
+    elif isinstance(responses, NumericalColumn):
+        return NumericalColumn(responses.values[drawn])
+    return [responses[i] for i in drawn.tolist()]
+
+
+def margin(size, confidence=CONFIDENCE):
+    """Calculates the margin of error of proportions estimated from a sample
+
+    By the Dvoretzky-Kiefer-Wolfowitz inequality, every proportion, and
+    the rank of every quantile, estimated from a uniform sample of size
+    responses is within this margin of its true value with probability
+    confidence.
+
+    Args:
+        size(int): the number of sampled responses
+        confidence(float): the probability that the estimates are within the margin
+
+    Returns:
+        The margin of error, as a proportion
+
+    >>> round(margin(10000), 4)
+    0.0136
+    """
+    return sqrt(log(2 / (1 - confidence)) / (2 * size))
+
+
+def top_categories(counts, top=TOP_CATEGORIES):
+    """Groups every category but the most common into "Other"
+
+    If a category is itself called "Other", the group is called "(Other)"
+    instead, so that the two are not added up.
+
+    Args:
+        counts(Counter): the counts of the categories, from aggregate()
+        top(int): the number of categories to keep, including "Other"
+
+    Returns:
+        A Counter of at most top categories
+
+    >>> top_categories(Counter({"A": 5, "B": 3, "C": 1, "D": 1}), 3)
+    Counter({'A': 5, 'B': 3, 'Other': 2})
+    >>> top_categories(Counter({"Other": 5, "B": 3, "C": 1, "D": 1}), 3)
+    Counter({'Other': 5, 'B': 3, '(Other)': 2})
+    """
+    if len(counts) <= top:
+        return counts
+    other = "Other"
+    while other in counts:
+        other = f"({other})"
+    kept = Counter(dict(counts.most_common(top - 1)))
+    kept[other] = sum(counts.values()) - sum(kept.values())
+    return kept
+
+
+def approximate_question(
+    category, responses, directory, sample_size=SAMPLE_SIZE, confidence=CONFIDENCE, clouds=True
+):
+    """Approximately analyses the responses to a single question
+
+    Numerical and openended questions with more than sample_size
+    responses are analysed from a uniform sample of their responses, so
+    that the time taken does not depend on the number of responses.
+    Categorical and multicategorical questions are always counted
+    exactly, as their Columns are counted with a single bincount, and
+    only keep their most common categories, see approximate_summary().
+
+    Args:
+        category(str): datatype of the responses
+            For example: "categorical"
+        responses(list/tuple/Column/NumericalColumn): the responses to the question
+        directory(str): path to the folder containing the excel file and config file
+            For example: "./static/uploads/4SikvVjjqlWV44AW/"
+        sample_size(int): the number of responses to sample
+        confidence(float): the confidence of the error bounds
+        clouds(bool): whether to render word clouds, see summarise()
+
+    Returns:
+        A tuple like that of analyse_question(), whose analysis also
+        contains its error bounds. The counts are None if the responses
+        were sampled, since they can not be merged with new responses.
+    """
+    total = len(responses)
+    if total <= sample_size or category in ("categorical", "multicategorical"):
+        counts = aggregate(category, responses)
+        if counts is None:
+            return None, None
+        return approximate_summary(category, counts, directory, confidence=confidence, clouds=clouds), counts
+
+    drawn = sample(responses, sample_size)
+    counts = aggregate(category, drawn)
+    if counts is None:
+        return None, None
+    analysed = approximate_summary(category, counts, directory, total, sample_size, confidence, clouds)
+    bound = margin(sample_size, confidence)
+    error = analysed[2]
+    if analysed[0] == "openended":
+        if isinstance(analysed[1], dict):
+            # Like the histogram, the counts of the sample are scaled up to all responses
+            analysed[1]["Frequencies"] = {
+                word: round(frequency * total / sample_size) for word, frequency in analysed[1]["Frequencies"].items()
+            }
+        error["Frequencies"] = bound
+    elif analysed[0] == "numerical":
+        # The sample cannot miss the extremes, which are cheap to find exactly
+        values = numpy.asarray(getattr(responses, "values", responses))
+        statistics = analysed[1]
+        statistics["Minimum"], statistics["Maximum"] = values.min().item(), values.max().item()
+        statistics["Histogram"]["Counts"] = [
+            round(frequency * total / sample_size) for frequency in statistics["Histogram"]["Counts"]
+        ]
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        error["Mean"] = z * statistics["Standard deviation"] / sqrt(sample_size)
+        error["Quantiles"] = bound
+    return analysed, None
+
+
+def approximate_summary(
+    category, counts, directory, total=None, sampled=None, confidence=CONFIDENCE, clouds=True
+):
+    """Analyses a question from the counts of its responses, see summarise()
+
+    Only the most common categories of categorical questions are kept,
+    and the rest are grouped into "Other", see top_categories().
+
+    Args:
+        category(str): datatype of the responses
+            For example: "categorical"
+        counts(Counter): the counts of the responses, from aggregate()
+        directory(str): path to the folder containing the excel file and config file
+        total(int): the number of responses, if counts only counts a sample
+        sampled(int): the number of sampled responses, if counts only counts a sample
+        confidence(float): the confidence of the error bounds
+        clouds(bool): whether to render word clouds, see summarise()
+
+    Returns:
+        A tuple containing the type of analysis, the analysis of the
+        responses and its error bounds, or None if the question is
+        ignored. Exact analyses have error bounds of 0.
+        For example:
+        ("categorical", {"Percentages": {"No": 0.5, "Yes": 0.5}},
+        {"Responses": 20000, "Sample": 10000, "Confidence": 0.95, "Percentages": 0.0136})
+
+    >>> approximate_summary("categorical", Counter({"Yes": 1, "No": 1}), ".")
+    ('categorical', {'Percentages': {'Yes': 0.5, 'No': 0.5}}, {'Responses': None, 'Sample': None, 'Confidence': 0.95, 'Percentages': 0.0})
+    """
+    if category in ("multicategorical", "categorical"):
+        counts = top_categories(counts)
+    analysed = summarise(category, counts, directory, clouds)
+    if analysed is None:
+        return None
+    error = {"Responses": total, "Sample": sampled, "Confidence": confidence}
+    if analysed[0] == "categorical":
+        error["Percentages"] = 0.0
+    elif analysed[0] == "openended":
+        error["Frequencies"] = 0.0
+    elif analysed[0] == "numerical":
+        error["Mean"] = error["Quantiles"] = 0.0
+    return analysed + (error,)
+
+
+def error_note(error):
+    """Describes the error bounds of an approximate analysis
+
+    Args:
+        error(dict): the error bounds, from approximate_summary()
+
+    Returns:
+        A sentence describing the error bounds, or None if the analysis is exact
+
+    >>> error_note({"Responses": 20000, "Sample": 10000, "Confidence": 0.95, "Percentages": 0.0136})
+    'Estimated from 10000 of 20000 responses: percentages are within 1.4% at 95% confidence'
+    """
+    if not error or not error["Sample"]:
+        return None
+    bounds = []
+    if "Percentages" in error:
+        bounds.append(f"percentages are within {error['Percentages']:.1%}")
+    if "Frequencies" in error:
+        bounds.append(f"the share of responses using each word is within {error['Frequencies']:.1%}")
+    if "Mean" in error:
+        bounds.append(f"the mean is within {error['Mean']:.3g}")
+    if "Quantiles" in error:
+        bounds.append(f"quantiles are within {error['Quantiles']:.1%} of their ranks")
+    return (
+        f"Estimated from {error['Sample']} of {error['Responses']} responses: "
+        f"{' and '.join(bounds)} at {error['Confidence']:.0%} confidence"
+    )
+
+
+def analyse(
+    directory,
+    survey_file,
+    config_file,
+    workers=1,
+    cache=None,
+    progress=None,
+    chunk_size=CHUNK_SIZE,
+    aggregates=None,
+    approximate=False,
+    clouds=True,
+):
     """Analyses survey responses
 
+    Questions are independent of each other, so when more than one worker
+    is given they are analysed in a pool of processes. The analysis falls
+    back to a single process if the pool cannot be used.
+
+    Only the questions that are not ignored in the config are parsed.
+
+    If a cache is given, a survey that has already been analysed with the
+    same config is read back from the cache instead. Otherwise, every
+    question whose responses have already been analysed as the same
+    datatype is read back from the cache, so that changing the config
+    only reanalyses the questions whose datatype changed.
+
     Args:
         directory(str): path to the folder containing the excel file and config file
             For example: "./static/uploads/4SikvVjjqlWV44AW/"
@@ -161,39 +828,223 @@ def analyse(directory, survey_file, config_file):
             For example: "responses.xlsx" or "responses.csv"
         config_file(str): name of config file
             For example: "config_file.txt"
+        workers(int): maximum number of processes to analyse questions in
+        cache(AnalysisCache): cache to read and write the analysis from
+        progress(function): called with the number of questions analysed,
+            the number of questions to analyse and the question that was
+            just analysed, every time a question has been analysed
+        chunk_size(int): number of rows of a csv file to parse at a time,
+            see utils.parse_csv()
+        aggregates(dict): if given, filled with a tuple of the datatype
+            and the counts of the responses to each question, from
+            aggregate(), so that new responses can be merged later
+        approximate(bool): whether to analyse the questions approximately,
+            see approximate_question(). The analysis of each question
+            then also contains its error bounds.
+        clouds(bool): whether to render the word clouds of openended
+            questions, or only keep their most common words, see summarise()
 
     Returns:
         A dictionary mapping each survey question to the analysis of its
-        responses.
+        responses, in the order of the questions in the survey.
     """
-    if survey_file.endswith(".csv"):
-        parsed_file = parse_csv(os.path.join(directory, survey_file))
-    else:
-        parsed_file = parse_excel(os.path.join(directory, survey_file))
+    datatypes = parse_config(os.path.join(directory, config_file))
+    if aggregates is None:
+        aggregates = {}
+    if cache:
+        with metrics.timed("cache_lookup"):
+            key = cache.key(
+                os.path.join(directory, survey_file),
+                datatypes,
+                os.path.splitext(survey_file)[1],
+                approximate,
+                clouds,
+            )
+            counted = cache.get_aggregates(key)
+            analysis = cache.get(key, directory) if counted is not None else None
+        metrics.lookup("analysis", hits=int(analysis is not None), misses=int(analysis is None))
+        if analysis is not None:
+            aggregates.update(counted)
+            return analysis
 
-    categorised_responses = categorise(
-        parsed_file,
-        parse_config(os.path.join(directory, config_file)),
-    )
-    analysis = {}
-    analysed = None
-    for qn, responses in categorised_responses.items():
-        category = responses[0]
-        list_of_responses = responses[1]
-        if category == "numerical":
-            analysed = ("numerical", numerical(list(map(int, list_of_responses))))
-        elif category == "multicategorical":
-            analysed = ("categorical", multi_categorical(list_of_responses))
-        elif category == "categorical":
-            analysed = ("categorical", categorical(list_of_responses))
-        elif category == "openended":
-            analysed = ("openended", openended(list_of_responses, directory))
+    # Ignored questions are never parsed
+    with metrics.timed("load_survey"):
+        parsed_file = load_survey(
+            os.path.join(directory, survey_file),
+            datatypes,
+            columns=[number for number, datatype in datatypes.items() if datatype != "ignore"],
+            chunk_size=chunk_size,
+        )
+    metrics.REGISTRY.observe("survey_rows", max(map(len, parsed_file.values()), default=0))
+    metrics.REGISTRY.observe("survey_columns", len(parsed_file))
+
+    categorised_responses = categorise(parsed_file, datatypes)
+    tasks = [
+        (qn, responses) for qn, responses in categorised_responses.items()
+        if responses[0] != "ignore"
+    ]
+    analysis = dict.fromkeys(parsed_file.headers)
+    keys, pending = {}, []
+    for qn, (category, responses) in tasks:
+        if cache:
+            keys[qn] = cache.question_key(category, responses, approximate, clouds)
+            counted = cache.get_aggregates(keys[qn])
+            cached = cache.get(keys[qn], directory) if counted is not None else None
+            if cached is not None:
+                analysis[qn] = next(iter(cached.values()))
+                aggregates[qn] = next(iter(counted.values()))
+                continue
+        pending.append((qn, (category, responses)))
+    if cache:
+        metrics.lookup("question", hits=len(tasks) - len(pending), misses=len(pending))
+
+    done = len(tasks) - len(pending)
+    function = approximate_question if approximate else analyse_question
+    for qn, (analysed, counts) in run_questions(pending, directory, workers, function, clouds=clouds):
         analysis[qn] = analysed
-        analysed = None
+        if counts is not None:
+            aggregates[qn] = (categorised_responses[qn][0], counts)
+        done += 1
+        if progress:
+            progress(done, len(tasks), qn)
+    if cache:
+        with metrics.timed("cache_store"):
+            for qn, responses in pending:
+                cache.put(keys[qn], {qn: analysis[qn]}, {qn: aggregates.get(qn)})
+            cache.put(key, analysis, {qn: aggregates.get(qn) for qn, responses in tasks})
     return analysis
 
 
-def generate_report(directory, analysis):
+def merge(
+    directory,
+    delta_file,
+    config_file,
+    analysis,
+    aggregates,
+    workers=1,
+    progress=None,
+    chunk_size=CHUNK_SIZE,
+    approximate=False,
+):
+    """Merges new responses into an analysis
+
+    The new responses are counted and added to the counts of the
+    responses that were already analysed, and the questions are analysed
+    again from the merged counts, so the work done only depends on the
+    number of new responses and the number of distinct responses.
+
+    Args:
+        directory(str): path to the folder containing the excel file and config file
+            For example: "./static/uploads/4SikvVjjqlWV44AW/"
+        delta_file(str): name of the survey file (excel/csv) containing
+            the new responses, with the same questions as the survey
+            For example: "week2.xlsx"
+        config_file(str): name of the config file of the survey
+            For example: "config_file.txt"
+        analysis(dict): analysis of the survey, from analyse()
+        aggregates(dict): counts of the responses of the survey, filled in
+            by analyse(). The new responses are added to them.
+        workers(int): maximum number of processes to analyse questions in
+        progress(function): called like the progress of analyse()
+        chunk_size(int): number of rows of a csv file to parse at a time,
+            see utils.parse_csv()
+        approximate(bool): whether the analysis is approximate, see analyse()
+
+    Returns:
+        A tuple containing a dictionary mapping each survey question to
+        the analysis of all of its responses, in the order of the questions
+        in the survey, and a list of the paths to the word clouds of the
+        old analysis. They are not deleted, as the old analysis is still
+        shown until the merged analysis is stored.
+
+    Raises:
+        KeyError: The questions of delta_file are not those of the survey
+    """
+    datatypes = parse_config(os.path.join(directory, config_file))
+    delta = load_survey(
+        os.path.join(directory, delta_file),
+        datatypes,
+        columns=[number for number, datatype in datatypes.items() if datatype != "ignore"],
+        chunk_size=chunk_size,
+    )
+    if list(dict.fromkeys(delta.headers)) != list(analysis):
+        raise KeyError(f"The questions in {delta_file} are not those of the survey")
+
+    tasks = []
+    for qn, (category, responses) in categorise(delta, datatypes).items():
+        if category == "ignore":
+            continue
+        if not aggregates.get(qn) or aggregates[qn][0] != category:
+            raise KeyError(f"The responses to '{qn}' were not counted as {category}")
+        aggregates[qn][1].update(aggregate(category, responses))
+        tasks.append((qn, aggregates[qn]))
+
+    analysis = dict(analysis)
+    function = approximate_summary if approximate else summarise
+    # Word clouds are only rendered if the analysis already had them
+    clouds = all(
+        isinstance(analysis[qn][1], str) for qn, counted in tasks if counted[0] == "openended" and analysis[qn]
+    )
+    numbers = {qn: number for number, qn in enumerate(analysis, 1)}
+    questions = run_questions(tasks, directory, workers, function, clouds=clouds)
+    stale = []
+    for done, (qn, analysed) in enumerate(questions, 1):
+        if analysis[qn] and analysis[qn][0] == "openended":
+            # The word cloud of the old responses is out of date
+            stale.append(analysis[qn][1] if clouds else cloud_path(directory, numbers[qn], analysis[qn][1]))
+        analysis[qn] = analysed
+        if progress:
+            progress(done, len(tasks), qn)
+    return analysis, stale
+
+
+def run_questions(tasks, directory, workers=1, function=analyse_question, **options):
+    """Analyses questions, in a pool of processes if more than one worker is given
+
+    Falls back to a single process if the pool cannot be used.
+
+    Args:
+        tasks(list): list of tuples containing a question and a tuple of
+            its datatype and responses, as in the output of categorise()
+            For example: [("Do you like python?", ("categorical", ("yes", "no")))]
+        directory(str): path to the folder containing the excel file and config file
+            For example: "./static/uploads/4SikvVjjqlWV44AW/"
+        workers(int): maximum number of processes to analyse questions in
+        function(function): called with the datatype, the responses and
+            directory to analyse each question, such as analyse_question()
+            and approximate_question(), or summarise() and
+            approximate_summary() with the counts of the responses
+        options: keyword arguments passed on to function
+            For example: clouds=False
+
+    Yields:
+        A tuple containing a question and its analysis, in the order in
+        which the questions finish
+    """
+    finished = set()
+    if workers > 1 and len(tasks) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+                futures = {
+                    executor.submit(metrics.timed_call, function, *responses, directory, **options): i
+                    for i, (qn, responses) in enumerate(tasks)
+                }
+                for future in as_completed(futures):
+                    seconds, analysed = future.result()
+                    i = futures[future]
+                    finished.add(i)
+                    metrics.record(function.__name__, seconds, category=tasks[i][1][0])
+                    yield tasks[i][0], analysed
+        except (OSError, BrokenProcessPool):
+            pass
+    for i, (qn, responses) in enumerate(tasks):
+        if i not in finished:
+            seconds, analysed = metrics.timed_call(function, *responses, directory, **options)
+            metrics.record(function.__name__, seconds, category=responses[0])
+            yield qn, analysed
+
+
+def generate_report(directory, analysis, survey_file=None):
     """Generates a report based on analysis
 
     Generates a .docx report based on the analysis from analysis().
@@ -204,10 +1055,20 @@ def generate_report(directory, analysis):
             For example: "./static/uploads/4SikvVjjqlWV44AW/"
         analysis(dict): analysis of the original excel file and config file
             from analysis()
+        survey_file(str): name of the survey file that the report is titled
+            after, rather than any file that responses were added from
 
     Returns:
         A string that is the path to the report file
     """
+    with metrics.timed("generate_report"):
+        return write_report(directory, analysis, survey_file)
+
+
+def write_report(directory, analysis, survey_file=None):
+    """Writes the report of generate_report()"""
+    from docx import Document
+
     document = Document()
 
     # Metadata
@@ -217,23 +1078,25 @@ def generate_report(directory, analysis):
     core_properties.language = "English"
 
     # Title
-    filename = "survey file"
-    for file in os.listdir(directory):
-        if file.endswith(".xlsx") or file.endswith(".csv"):
-            filename = os.path.basename(file)
-            break
+    filename = os.path.basename(survey_file) if survey_file else "survey file"
     document.add_heading(f"Report of {filename}", 0)
 
     # Adding analysis
-    for qn, analysed in analysis.items():
+    for number, (qn, analysed) in enumerate(analysis.items(), 1):
         if analysed is None:
             continue
-        elif analysed[0] == "numerical":
+        note = error_note(analysed[2]) if len(analysed) > 2 else None
+        if analysed[0] == "numerical":
             document.add_heading(qn, level=1)
             # Content
             document.add_paragraph(f"Mean: {analysed[1]['Mean']}", style="List Bullet")
             document.add_paragraph(f"Median: {analysed[1]['Median']}", style="List Bullet")
             document.add_paragraph(f"Mode: {analysed[1]['Mode']}", style="List Bullet")
+            for statistic in ("Standard deviation", "Minimum", "Maximum", "Quartiles"):
+                if statistic in analysed[1]:
+                    document.add_paragraph(
+                        f"{statistic}: {analysed[1][statistic]}", style="List Bullet"
+                    )
         elif analysed[0] == "categorical":
             document.add_heading(qn, level=1)
             # Content
@@ -251,7 +1114,12 @@ def generate_report(directory, analysis):
         elif analysed[0] == "openended":
             document.add_heading(qn, level=1)
             # Content
-            document.add_picture(os.path.join(analysed[1]))
+            if isinstance(analysed[1], str):
+                document.add_picture(os.path.join(analysed[1]))
+            else:
+                document.add_picture(cloud(directory, analysed[1], number))
+        if note:
+            document.add_paragraph().add_run(note).italic = True
 
     path = os.path.join(directory, f"{secure(8)}.docx")
     document.save(path)
@@ -0,0 +1,282 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Analyses many surveys without the web app.
+
+This module analyses every survey file in a folder or matching a glob,
+one survey per process, and writes the analysis of each survey as JSON
+next to its report, cloud images and the time taken by every stage.
+A config file is looked up for every survey: either the one given on the
+command line, one named after the survey such as responses.txt for
+responses.xlsx, or a config_file.txt in the folder of the survey.
+
+Usage:
+    python batch.py "exports/*.xlsx" --output results/
+"""
+# Imports
+import argparse
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import numpy
+
+import analyse
+import metrics
+from cache import AnalysisCache
+from utils import CHUNK_SIZE
+
+EXTENSIONS = (".xlsx", ".csv")
+CONFIG = "config_file.txt"
+
+
+def find_surveys(patterns):
+    """Finds the survey files to analyse
+
+    Args:
+        patterns(list): Folders, whose survey files are all analysed, or
+            globs of survey files
+            For example: ["exports/", "archive/2019-*.csv"]
+
+    Returns:
+        A sorted list of the absolute paths to the survey files
+    """
+    surveys = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        surveys.update(
+            os.path.abspath(path)
+            for path in glob.glob(pattern)
+            if os.path.isfile(path) and path.endswith(EXTENSIONS)
+        )
+    return sorted(surveys)
+
+
+def find_config(survey_file, config_file=None):
+    """Finds the config file of a survey file
+
+    Args:
+        survey_file(str): path to the survey file (excel/csv)
+        config_file(str): path to a config file shared by every survey
+
+    Returns:
+        The path to the config file, or None if there is none
+    """
+    stem = os.path.splitext(survey_file)[0]
+    for path in (config_file, f"{stem}.txt", os.path.join(os.path.dirname(survey_file), CONFIG)):
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+
+def to_json(value):
+    """Converts what json can not serialise in an analysis"""
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def link(source, destination):
+    """Hard links a file, or copies it if it can not be linked"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def analyse_survey(
+    survey_file, config_file, directory, workers=1, cache=None, chunk_size=CHUNK_SIZE, approximate=False
+):
+    """Analyses a survey and writes its summary and report
+
+    The survey file and its config are linked into directory, where the
+    report, the cloud images and summary.json are written, as
+    analyse.analyse() only reads and writes files in a single folder.
+
+    Args:
+        survey_file(str): path to the survey file (excel/csv)
+        config_file(str): path to the config file of the survey
+        directory(str): path to the folder to write the results in. It
+            must not exist yet.
+        workers(int): maximum number of processes to analyse the questions
+            of the survey in, see analyse.analyse()
+        cache(str): path to the folder of an AnalysisCache, if any
+        chunk_size(int): number of rows of a csv file to parse at a time
+        approximate(bool): whether to analyse the survey approximately
+
+    Returns:
+        A dictionary summing up the result, such as:
+        {"File": "exports/responses.xlsx", "Output": "results/responses",
+        "State": "done", "Error": None,
+        "Seconds": {"Total": 1.52, "analyse": 1.2, "generate_report": 0.3, ...}}
+        where the other durations are those of the stages timed in metrics
+    """
+    start = perf_counter()
+    breakdown = metrics.start_breakdown()
+    result = {"File": survey_file, "Output": directory, "State": "done", "Error": None}
+    try:
+        os.makedirs(directory)
+        survey_name, config_name = os.path.basename(survey_file), CONFIG
+        link(survey_file, os.path.join(directory, survey_name))
+        link(config_file, os.path.join(directory, config_name))
+        with metrics.timed("analyse"):
+            analysis = analyse.analyse(
+                directory,
+                survey_name,
+                config_name,
+                workers=workers,
+                cache=AnalysisCache(cache) if cache else None,
+                chunk_size=chunk_size,
+                approximate=approximate,
+            )
+        report = analyse.generate_report(directory, analysis, survey_name)
+        # Generated files are listed relative to the summary
+        summary = {
+            qn: (analysed[0], os.path.basename(analysed[1])) + analysed[2:]
+            if analysed and isinstance(analysed[1], str) else analysed
+            for qn, analysed in analysis.items()
+        }
+        with open(os.path.join(directory, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"File": survey_name, "Report": os.path.basename(report), "Analysis": summary},
+                f,
+                indent=2,
+                default=to_json,
+            )
+    except ValueError:
+        result.update(State="failed", Error="ValueError! Perhaps a wrong category was chosen for the data")
+    except Exception as e:
+        result.update(State="failed", Error=f"Unknown error: {str(e)}")
+    result["Seconds"] = dict(Total=perf_counter() - start, **metrics.stop_breakdown(breakdown))
+    return result
+
+
+def run(surveys, output, config_file=None, processes=None, workers=1, cache=None,
+        chunk_size=CHUNK_SIZE, approximate=False, progress=None):
+    """Analyses surveys in parallel
+
+    Every survey is analysed in its own process, see analyse_survey(), in
+    a folder of output named after the survey file.
+
+    Args:
+        surveys(list): paths to the survey files, from find_surveys()
+        output(str): path to the folder to write the results in
+        config_file(str): path to a config file shared by every survey,
+            see find_config()
+        processes(int): number of surveys analysed at the same time.
+            Defaults to the number of CPUs.
+        workers(int): number of processes each survey is analysed in
+        cache(str): path to the folder of an AnalysisCache, if any
+        chunk_size(int): number of rows of a csv file to parse at a time
+        approximate(bool): whether to analyse the surveys approximately
+        progress(function): called with the result of every survey, from
+            analyse_survey(), as soon as it has been analysed
+
+    Returns:
+        A dictionary containing the result of every survey, in the order
+        of surveys, and the time taken by the whole batch, such as:
+        {"Surveys": [...], "Failed": 0, "Seconds": 12.1, "Throughput": 8.2}
+        where the throughput is in surveys per second. It is also saved
+        as batch.json in output.
+    """
+    start = perf_counter()
+    os.makedirs(output, exist_ok=True)
+    results, tasks, names = [None] * len(surveys), [], set(os.listdir(output))
+    for i, survey_file in enumerate(surveys):
+        stem = name = os.path.splitext(os.path.basename(survey_file))[0]
+        # Surveys with the same name, such as a.xlsx and a.csv, get their own folder
+        suffix = 1
+        while name in names:
+            suffix += 1
+            name = f"{stem}_{suffix}"
+        names.add(name)
+        config = find_config(survey_file, config_file)
+        if config is None:
+            results[i] = {"File": survey_file, "Output": None, "State": "failed",
+                          "Error": "No config file", "Seconds": {"Total": 0}}
+            if progress:
+                progress(results[i])
+            continue
+        tasks.append((i, (survey_file, config, os.path.join(output, name))))
+
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count() or 1) as executor:
+        futures = {
+            executor.submit(analyse_survey, *task, workers, cache, chunk_size, approximate): i
+            for i, task in tasks
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if progress:
+                progress(results[futures[future]])
+
+    seconds = perf_counter() - start
+    batch = {
+        "Surveys": results,
+        "Failed": sum(1 for result in results if result["State"] == "failed"),
+        "Seconds": seconds,
+        "Throughput": len(surveys) / seconds if seconds else None,
+    }
+    with open(os.path.join(output, "batch.json"), "w", encoding="utf-8") as f:
+        json.dump(batch, f, indent=2)
+    return batch
+
+
+def report_progress(result):
+    """Prints the result of a survey, from analyse_survey()"""
+    if result["State"] == "done":
+        print(f"{result['File']}: {result['Seconds']['Total']:.3f}s, saved in {result['Output']}")
+    else:
+        print(f"{result['File']}: {result['Error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyses many surveys without the web app.")
+    parser.add_argument("surveys", nargs="+", help="folders or globs of survey files (excel/csv)")
+    parser.add_argument("--output", default="results", help="folder to write the results in")
+    parser.add_argument("--config", help=f"config file of every survey, instead of <survey>.txt or {CONFIG}")
+    parser.add_argument("--processes", type=int, help="number of surveys analysed at the same time")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes each survey is analysed in")
+    parser.add_argument("--cache", help="folder to cache analyses in")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows of a csv file parsed at a time")
+    parser.add_argument("--approximate", action="store_true", help="analyse large surveys approximately")
+    args = parser.parse_args()
+    # Assets such as analyse.FONT are relative to the repository
+    surveys = find_surveys(args.surveys)
+    output = os.path.abspath(args.output)
+    config = os.path.abspath(args.config) if args.config else None
+    cache = os.path.abspath(args.cache) if args.cache else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if not surveys:
+        parser.error("no survey files found")
+    batch = run(surveys, output, config, args.processes, args.workers, cache, args.chunk_size,
+                args.approximate, report_progress)
+    print(
+        f"Analysed {len(surveys) - batch['Failed']} of {len(surveys)} surveys in {batch['Seconds']:.3f}s, "
+        f"saved in {os.path.join(output, 'batch.json')}"
+    )
@@ -0,0 +1,466 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Benchmarks the analysis of surveys.
+
+This module generates synthetic surveys of any size and times every stage
+of their analysis separately, from parsing to generating the report. The
+throughput and peak memory of every stage are saved as JSON, so that the
+results of two versions can be compared.
+
+Usage:
+    python benchmark.py generate   Writes a synthetic survey and its config
+    python benchmark.py run        Benchmarks every stage on a synthetic survey
+    python benchmark.py imports    Benchmarks the cold start of a worker
+    python benchmark.py compare    Compares two benchmark results
+"""
+# Imports
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from csv import writer
+from random import Random
+
+from openpyxl import Workbook
+
+import analyse
+import utils
+
+MIX = {"categorical": 0.4, "multicategorical": 0.1, "numerical": 0.2, "openended": 0.2, "ignore": 0.1}
+VOCABULARY = 2000
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pu", "qua", "ber"]
+STOPWORDS = ["the", "and", "it", "was", "to", "a", "of", "is"]
+# Run in a new interpreter, so that nothing has been imported yet
+COLD_START = """
+import json, resource, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+import analyse
+analyse.warm_up()
+print(json.dumps({
+    "Import": imported - start,
+    "Import RSS": rss,
+    "Warm up": time.perf_counter() - imported,
+    "Warm up RSS": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+}))
+"""
+
+
+def column_types(columns, mix=MIX):
+    """Assigns a datatype to every column of a survey
+
+    Args:
+        columns(int): Number of columns
+        mix(dict): Proportion of the columns of each datatype
+
+    Returns:
+        A list of the datatype of each column, in an interleaved order
+
+    >>> column_types(5, {"categorical": 0.6, "numerical": 0.4})
+    ['categorical', 'numerical', 'categorical', 'numerical', 'categorical']
+    """
+    total = sum(mix.values())
+    remaining = {datatype: round(columns * share / total) for datatype, share in mix.items()}
+    types = []
+    while len(types) < columns:
+        for datatype in mix:
+            if remaining[datatype] > 0 and len(types) < columns:
+                types.append(datatype)
+                remaining[datatype] -= 1
+        if not any(count > 0 for count in remaining.values()):
+            types.extend([next(iter(mix))] * (columns - len(types)))
+    return types
+
+
+def generate_survey(
+    directory,
+    rows=1000,
+    columns=12,
+    mix=MIX,
+    cardinality=5,
+    text_length=8,
+    seed=0,
+    formats=("xlsx", "csv"),
+):
+    """Writes a synthetic survey and its config
+
+    Categories and words are drawn with Zipf-like frequencies, so that
+    some responses are much more common than others, as in real surveys.
+
+    Args:
+        directory(str): Folder to write the survey files and config file in
+        rows(int): Number of responses
+        columns(int): Number of questions
+        mix(dict): Proportion of the questions of each datatype
+            For example: {"categorical": 0.5, "openended": 0.5}
+        cardinality(int): Number of categories of categorical and
+            multicategorical questions
+        text_length(int): Number of words in each openended response
+        seed(int): Seed of the random generator
+        formats(tuple): Formats of the survey files to write, "xlsx" and/or "csv"
+
+    Returns:
+        A dictionary containing the names of the files written
+        For example:
+        {"xlsx": "responses.xlsx", "csv": "responses.csv", "Config": "config_file.txt"}
+    """
+    random = Random(seed)
+    types = column_types(columns, mix)
+    categories = [f"Option {i + 1}" for i in range(cardinality)]
+    category_weights = [1 / (i + 1) for i in range(cardinality)]
+    words = STOPWORDS + [
+        "".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4))) for _ in range(VOCABULARY)
+    ]
+    word_weights = [1 / (i + 1) for i in range(len(words))]
+
+    def response(datatype, row):
+        if datatype == "categorical":
+            return random.choices(categories, category_weights)[0]
+        elif datatype == "multicategorical":
+            chosen = random.choices(categories, category_weights, k=random.randint(1, 3))
+            return ";".join(dict.fromkeys(chosen))
+        elif datatype == "numerical":
+            return random.randint(0, 100)
+        elif datatype == "openended":
+            return " ".join(random.choices(words, word_weights, k=text_length))
+        return f"Respondent {row}"
+
+    headers = [f"Question {i + 1} ({datatype})" for i, datatype in enumerate(types)]
+    table = [[response(datatype, row) for datatype in types] for row in range(rows)]
+
+    written = {}
+    if "xlsx" in formats:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(headers)
+        for row in table:
+            sheet.append(row)
+        workbook.save(os.path.join(directory, "responses.xlsx"))
+        written["xlsx"] = "responses.xlsx"
+    if "csv" in formats:
+        with open(os.path.join(directory, "responses.csv"), "w", newline="") as f:
+            output = writer(f)
+            output.writerow(headers)
+            output.writerows(table)
+        written["csv"] = "responses.csv"
+    with open(os.path.join(directory, "config_file.txt"), "w") as f:
+        f.write("".join(f"{i + 1} {datatype}\n" for i, datatype in enumerate(types)))
+    written["Config"] = "config_file.txt"
+    return written
+
+
+def measure(function, memory=True):
+    """Times a function and measures its peak memory
+
+    The function is called once to time it, and once more while tracing
+    memory allocations if memory is True, since tracing slows it down.
+
+    Args:
+        function(function): Function to call without arguments
+        memory(bool): Whether to measure the peak memory
+
+    Returns:
+        A tuple containing the result of the function, the seconds it took
+        and the peak memory it allocated in bytes, or None
+    """
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def stage(seconds, peak, items, unit):
+    """Summarises the measurements of a stage
+
+    Args:
+        seconds(float): Seconds the stage took
+        peak(int): Peak memory of the stage in bytes, or None
+        items(int): Number of items processed by the stage
+        unit(str): What the items are
+            For example: "rows"
+
+    Returns:
+        A dictionary of the measurements
+        For example:
+        {"Seconds": 0.5, "Items": 1000, "Unit": "rows", "Throughput": 2000.0, "Peak memory": 1048576}
+    """
+    return {
+        "Seconds": seconds,
+        "Items": items,
+        "Unit": unit,
+        "Throughput": items / seconds if seconds else None,
+        "Peak memory": peak,
+    }
+
+
+def version():
+    """Returns the git commit being benchmarked, or None outside of a git repository"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(directory=None, memory=True, **parameters):
+    """Benchmarks every stage of the analysis of a synthetic survey
+
+    Args:
+        directory(str): Folder to write the survey in. Defaults to a
+            temporary folder, which is removed afterwards.
+        memory(bool): Whether to measure the peak memory of every stage
+        parameters: Parameters of the survey, see generate_survey()
+
+    Returns:
+        A dictionary containing the version benchmarked, the parameters of
+        the survey and the measurements of every stage, see stage()
+    """
+    temporary = directory is None
+    if temporary:
+        directory = tempfile.mkdtemp(prefix="surveyinator-")
+    parameters.setdefault("formats", ("xlsx", "csv"))
+    try:
+        written = generate_survey(directory, **parameters)
+        rows = parameters.get("rows", 1000)
+        stages = {}
+
+        config_file = os.path.join(directory, written["Config"])
+        datatypes, seconds, peak = measure(lambda: utils.parse_config(config_file), memory)
+        stages["parse_config"] = stage(seconds, peak, len(datatypes), "questions")
+
+        survey = None
+        for form, parse in (("xlsx", utils.parse_excel), ("csv", utils.parse_csv)):
+            if form in written:
+                path = os.path.join(directory, written[form])
+                survey, seconds, peak = measure(lambda: parse(path, datatypes), memory)
+                stages[parse.__name__] = stage(seconds, peak, rows, "rows")
+
+        categorised = analyse.categorise(survey, datatypes)
+        analysers = {
+            "categorical": analyse.categorical,
+            "multi_categorical": analyse.multi_categorical,
+            "numerical": lambda responses: analyse.numerical(responses.values),
+            "openended": lambda responses: analyse.openended(responses, directory),
+        }
+        analysis = dict.fromkeys(survey)
+        for name, analyser in analysers.items():
+            category = name.replace("_", "")
+            questions = [qn for qn, (datatype, responses) in categorised.items() if datatype == category]
+            if not questions:
+                continue
+            results, seconds, peak = measure(
+                lambda: [analyser(categorised[qn][1]) for qn in questions], memory
+            )
+            stages[name] = stage(seconds, peak, rows * len(questions), "responses")
+            kind = "categorical" if category == "multicategorical" else category
+            analysis.update((qn, (kind, result)) for qn, result in zip(questions, results))
+
+        charts = [(qn, analysed[1]["Percentages"]) for qn, analysed in analysis.items()
+                  if analysed and analysed[0] == "categorical"]
+        if charts:
+            _, seconds, peak = measure(
+                lambda: [utils.pie(qn, list(shares), list(shares.values())) for qn, shares in charts],
+                memory,
+            )
+            stages["pie"] = stage(seconds, peak, len(charts), "charts")
+
+        _, seconds, peak = measure(lambda: analyse.generate_report(directory, analysis, path), memory)
+        stages["generate_report"] = stage(
+            seconds, peak, sum(1 for analysed in analysis.values() if analysed), "questions"
+        )
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    parameters["formats"] = list(parameters["formats"])
+    return {
+        "Version": version(),
+        "Python": platform.python_version(),
+        "Parameters": parameters,
+        "Stages": stages,
+    }
+
+
+def imports(module="main", runs=5):
+    """Benchmarks the cold start of a worker
+
+    module is imported in a new interpreter, which then warms up with
+    analyse.warm_up(). The time taken and the resident memory after each
+    step are measured, and the fastest of runs is kept.
+
+    Args:
+        module(str): Module to import, such as "main" for the web app
+        runs(int): Number of interpreters to start
+
+    Returns:
+        A dictionary like that of run(), with an "import" and a "warm_up" stage
+    """
+    measurements = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START, module],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        measurements.append(json.loads(output.splitlines()[-1]))
+    fastest = min(measurements, key=lambda measured: measured["Import"])
+    return {
+        "Version": version(),
+        "Python": platform.python_version(),
+        "Parameters": {"module": module, "runs": runs},
+        "Stages": {
+            "import": stage(fastest["Import"], fastest["Import RSS"], 1, "workers"),
+            "warm_up": stage(fastest["Warm up"], fastest["Warm up RSS"], 1, "workers"),
+        },
+    }
+
+
+def compare(old, new):
+    """Compares two benchmark results
+
+    Args:
+        old(dict): Results of the baseline, from run()
+        new(dict): Results to compare with the baseline, from run()
+
+    Returns:
+        A dictionary mapping every stage benchmarked in both results to the
+        ratio of the new time and peak memory to the old ones
+        For example:
+        {"parse_csv": {"Seconds": 0.5, "Peak memory": 1.2}}
+
+    >>> compare({"Stages": {"pie": {"Seconds": 2.0, "Peak memory": None}}},
+    ...         {"Stages": {"pie": {"Seconds": 1.0, "Peak memory": 10}}})
+    {'pie': {'Seconds': 0.5, 'Peak memory': None}}
+    """
+    ratios = {}
+    for name, before in old["Stages"].items():
+        after = new["Stages"].get(name)
+        if after is None:
+            continue
+        ratios[name] = {
+            measurement: after[measurement] / before[measurement]
+            if before[measurement] and after[measurement] is not None else None
+            for measurement in ("Seconds", "Peak memory")
+        }
+    return ratios
+
+
+def parse_mix(text):
+    """Parses a mix of datatypes from the command line
+
+    >>> parse_mix("categorical=3,openended=1")
+    {'categorical': 3.0, 'openended': 1.0}
+    """
+    mix = {}
+    for part in text.split(","):
+        datatype, _, share = part.partition("=")
+        mix[datatype.strip()] = float(share)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the analysis of surveys.")
+    parser.add_argument("command", choices=("generate", "run", "imports", "compare"))
+    parser.add_argument("results", nargs="*", help="the old and new results to compare")
+    parser.add_argument("--rows", type=int, default=1000, help="number of responses")
+    parser.add_argument("--columns", type=int, default=12, help="number of questions")
+    parser.add_argument("--mix", type=parse_mix, default=MIX,
+                        help="proportion of each datatype, such as categorical=0.5,openended=0.5")
+    parser.add_argument("--cardinality", type=int, default=5, help="number of categories")
+    parser.add_argument("--text-length", type=int, default=8, help="number of words in openended responses")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    parser.add_argument("--formats", default="xlsx,csv", help="formats of the survey files")
+    parser.add_argument("--directory", help="folder to write the survey in, a temporary folder by default")
+    parser.add_argument("--output", default="benchmark.json", help="path to save the results to")
+    parser.add_argument("--no-memory", action="store_true", help="skip measuring peak memory")
+    parser.add_argument("--module", default="main", help="module whose cold start is benchmarked")
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to benchmark")
+    args = parser.parse_args()
+    # Assets such as analyse.FONT are relative to the repository
+    args.results = [os.path.abspath(path) for path in args.results]
+    args.output = os.path.abspath(args.output)
+    if args.directory:
+        args.directory = os.path.abspath(args.directory)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    survey = {
+        "rows": args.rows,
+        "columns": args.columns,
+        "mix": args.mix,
+        "cardinality": args.cardinality,
+        "text_length": args.text_length,
+        "seed": args.seed,
+        "formats": tuple(args.formats.split(",")),
+    }
+    if args.command == "generate":
+        directory = args.directory or os.path.dirname(args.output)
+        os.makedirs(directory, exist_ok=True)
+        for name in generate_survey(directory, **survey).values():
+            print(f"Saved {os.path.join(directory, name)}")
+    elif args.command in ("run", "imports"):
+        if args.command == "run":
+            results = run(args.directory, memory=not args.no_memory, **survey)
+        else:
+            results = imports(args.module, args.runs)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        for name, measurements in results["Stages"].items():
+            peak = measurements["Peak memory"]
+            print(
+                f"{name}: {measurements['Seconds']:.3f}s, "
+                f"{measurements['Throughput'] or 0:,.0f} {measurements['Unit']}/s"
+                + (f", {peak / 1024 ** 2:.1f} MiB peak" if peak is not None else "")
+            )
+        print(f"Saved {args.output}")
+    else:
+        if len(args.results) != 2:
+            parser.error("compare needs the old and new results")
+        with open(args.results[0]) as f, open(args.results[1]) as g:
+            ratios = compare(json.load(f), json.load(g))
+        for name, ratio in ratios.items():
+            print(f"{name}: " + ", ".join(
+                f"{measurement} x{value:.2f}" for measurement, value in ratio.items() if value is not None
+            ))
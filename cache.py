@@ -0,0 +1,206 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Caches analyses on disk.
+
+This module contains a content-addressed cache of the results of
+analyse.analyse(). Analyses are keyed by the bytes of the survey file and
+its config, so analysing the same survey with the same config again is
+read back from disk instead of being recomputed. The analysis of every
+question is also cached on its own, keyed by its responses and datatype.
+"""
+# Imports
+import os
+import pickle
+import shutil
+from hashlib import sha256
+
+from utils import secure
+
+
+def artefacts(analysis):
+    """Lists the files generated by an analysis
+
+    Args:
+        analysis(dict): analysis from analyse.analyse()
+
+    Returns:
+        A list of the questions whose analysis is the path to a file
+        For example: ["What could be improved?"]
+    """
+    return [qn for qn, analysed in analysis.items() if analysed and isinstance(analysed[1], str)]
+
+
+class AnalysisCache(object):
+    """On-disk cache of analyses with least recently used eviction
+
+    Every entry is a folder named after its key, containing the pickled
+    analysis, the counts of the responses it was computed from and a copy
+    of the files that the analysis generated.
+    """
+
+    def __init__(self, directory="./cache/", max_size=256 * 1024 ** 2):
+        """Creates a cache
+
+        Args:
+            directory(str): Directory to store the cache in
+            max_size(int): Size in bytes that the cache is evicted down to
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(survey_file, datatypes, *extra):
+        """Hashes a survey file and its config
+
+        Args:
+            survey_file(str): path to the survey file (excel/csv)
+            datatypes(dict): The datatypes of the responses mapped to
+                question number, from utils.parse_config()
+            extra: Any other values the analysis depends on
+
+        Returns:
+            A hexadecimal string identifying the analysis
+        """
+        digest = sha256()
+        with open(survey_file, "rb") as f:
+            for block in iter(lambda: f.read(1024 ** 2), b""):
+                digest.update(block)
+        digest.update(repr(sorted(datatypes.items())).encode("utf-8"))
+        digest.update(repr(extra).encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def question_key(category, responses, *extra):
+        """Hashes the responses to a question and their datatype
+
+        Args:
+            category(str): datatype of the responses
+                For example: "categorical"
+            responses(list/tuple/Column): the responses to the question
+            extra: Any other values the analysis depends on
+
+        Returns:
+            A hexadecimal string identifying the analysis of the question
+        """
+        digest = sha256(category.encode("utf-8") + repr(extra).encode("utf-8"))
+        if hasattr(responses, "fingerprint"):
+            digest.update(responses.fingerprint())
+        else:
+            digest.update(repr(list(responses)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key, directory):
+        """Reads an analysis from the cache
+
+        The files generated by the analysis are copied into directory.
+
+        Args:
+            key(str): Key of the analysis
+            directory(str): path to the folder to copy generated files into
+                For example: "./static/uploads/4SikvVjjqlWV44AW/"
+
+        Returns:
+            The analysis, or None if it is not in the cache
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, "analysis.pickle"), "rb") as f:
+                analysis = pickle.load(f)
+            for qn in artefacts(analysis):
+                name = analysis[qn][1]
+                path = os.path.join(directory, name)
+                shutil.copyfile(os.path.join(entry, name), path)
+                analysis[qn] = (analysis[qn][0], path) + analysis[qn][2:]
+            os.utime(entry)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return analysis
+
+    def get_aggregates(self, key):
+        """Reads the counts of the responses of an analysis from the cache
+
+        Args:
+            key(str): Key of the analysis
+
+        Returns:
+            The counts of the responses to each question, as filled in by
+            analyse.analyse(), or None if they are not in the cache
+        """
+        try:
+            with open(os.path.join(self.directory, key, "aggregates.pickle"), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, analysis, aggregates):
+        """Writes an analysis to the cache
+
+        Args:
+            key(str): Key of the analysis
+            analysis(dict): analysis from analyse.analyse()
+            aggregates(dict): counts of the responses to each question, as
+                filled in by analyse.analyse()
+        """
+        entry = os.path.join(self.directory, key)
+        if os.path.exists(os.path.join(entry, "aggregates.pickle")):
+            return
+        temp = os.path.join(self.directory, f".{secure(16)}")
+        os.mkdir(temp)
+        try:
+            stored = dict(analysis)
+            for qn in artefacts(analysis):
+                path = analysis[qn][1]
+                shutil.copyfile(path, os.path.join(temp, os.path.basename(path)))
+                stored[qn] = (analysis[qn][0], os.path.basename(path)) + analysis[qn][2:]
+            with open(os.path.join(temp, "analysis.pickle"), "wb") as f:
+                pickle.dump(stored, f)
+            with open(os.path.join(temp, "aggregates.pickle"), "wb") as f:
+                pickle.dump(aggregates, f)
+            # Entries cached before the counts were kept are replaced
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(temp, entry)
+        except OSError:
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_size"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith("."):
+                continue
+            entry = os.path.join(self.directory, name)
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry))
+                entries.append((os.stat(entry).st_mtime, size, entry))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
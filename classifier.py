@@ -0,0 +1,283 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Classifies survey questions by datatype.
+
+This module contains a compact Naive Bayes classifier over hashed words,
+which predicts the datatype of a question. The model is a single NumPy
+weight matrix saved as a .npz file, so it loads quickly and classifies a
+whole batch of questions in one matrix multiplication.
+
+Usage:
+    python classifier.py train     Retrains model.npz from the training data
+    python classifier.py compare   Compares model.npz with model.pickle
+"""
+# Imports
+import argparse
+import pickle
+import re
+from csv import reader
+from zlib import crc32
+
+import numpy
+
+TRAINING_DATA = "training data (offensive content).csv"
+MODEL = "model.npz"
+DIMENSIONS = 2 ** 12
+TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def features(question):
+    """Extracts the features of a question
+
+    The features of a question are its lowercased words and pairs of
+    adjacent words.
+
+    Args:
+        question(str): The question
+            For example: "How old are you?"
+
+    Returns:
+        A list of features
+
+    >>> features("How old?")
+    ['how', 'old', 'how old']
+    """
+    words = TOKEN.findall(question.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def vectorise(questions, dimensions=DIMENSIONS):
+    """Converts questions into hashed bags of words
+
+    Args:
+        questions(list/tuple): The questions to be converted
+        dimensions(int): Number of buckets features are hashed into
+
+    Returns:
+        A matrix with one row of feature counts per question
+    """
+    matrix = numpy.zeros((len(questions), dimensions), dtype=numpy.float32)
+    for i, question in enumerate(questions):
+        for feature in features(question):
+            matrix[i, crc32(feature.encode("utf-8")) % dimensions] += 1
+    return matrix
+
+
+class Classifier(object):
+    """Multinomial Naive Bayes classifier over hashed bags of words"""
+
+    def __init__(self, labels, weights, bias):
+        """Creates a classifier from its parameters
+
+        Args:
+            labels(list/tuple): The datatypes that can be predicted
+            weights(numpy.ndarray): Log-probability of each feature bucket
+                for each label, with shape (labels, dimensions)
+            bias(numpy.ndarray): Log-prior of each label
+        """
+        self.labels = tuple(labels)
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def train(cls, questions, labels, dimensions=DIMENSIONS, alpha=1.0):
+        """Trains a classifier
+
+        Args:
+            questions(list/tuple): The questions to learn from
+            labels(list/tuple): The datatype of each question
+            dimensions(int): Number of buckets features are hashed into
+            alpha(float): Additive smoothing of the feature counts
+
+        Returns:
+            The trained Classifier
+        """
+        classes = sorted(set(labels))
+        matrix = vectorise(questions, dimensions)
+        targets = numpy.array([classes.index(label) for label in labels])
+        counts = numpy.stack([matrix[targets == i].sum(axis=0) for i in range(len(classes))])
+        counts += alpha
+        weights = numpy.log(counts / counts.sum(axis=1, keepdims=True))
+        bias = numpy.log(numpy.bincount(targets, minlength=len(classes)) / len(targets))
+        return cls(classes, weights.astype(numpy.float32), bias.astype(numpy.float32))
+
+    @classmethod
+    def load(cls, path=MODEL):
+        """Loads a classifier saved with save()
+
+        Args:
+            path(str): Path to the .npz file
+
+        Returns:
+            The loaded Classifier
+        """
+        with numpy.load(path) as model:
+            return cls(model["labels"].tolist(), model["weights"], model["bias"])
+
+    def save(self, path=MODEL):
+        """Saves the classifier
+
+        Args:
+            path(str): Path to the .npz file
+        """
+        numpy.savez_compressed(
+            path, labels=numpy.array(self.labels), weights=self.weights, bias=self.bias
+        )
+
+    def classify_many(self, questions):
+        """Predicts the datatype of each question
+
+        Args:
+            questions(list/tuple): The questions to be classified
+
+        Returns:
+            A list containing the datatype of each question
+        """
+        if not len(questions):
+            return []
+        scores = vectorise(questions, self.weights.shape[1]) @ self.weights.T + self.bias
+        return [self.labels[i] for i in scores.argmax(axis=1).tolist()]
+
+    def classify(self, question):
+        """Predicts the datatype of a question
+
+        Args:
+            question(str): The question to be classified
+
+        Returns:
+            The datatype of the question
+        """
+        return self.classify_many([question])[0]
+
+
+def read_training_data(csv_file=TRAINING_DATA):
+    """Reads the training data
+
+    Every line of the training data contains a datatype and a question,
+    separated by a comma.
+
+    Args:
+        csv_file(str): Path to the training data
+
+    Returns:
+        A tuple containing a list of questions and a list of their datatypes
+    """
+    questions, labels = [], []
+    with open(csv_file, "r", encoding="utf-8") as f:
+        for row in reader(f):
+            if len(row) == 1:
+                row = row[0].split(" ", 1)
+            if len(row) < 2:
+                continue
+            labels.append(row[0].strip().lower())
+            questions.append(",".join(row[1:]).strip())
+    return questions, labels
+
+
+def accuracy(predictions, labels):
+    """Calculates the share of predictions that are correct
+
+    >>> accuracy(["numerical", "openended"], ["numerical", "categorical"])
+    0.5
+    """
+    return sum(p == l for p, l in zip(predictions, labels)) / len(labels)
+
+
+def cross_validate(questions, labels, folds=5):
+    """Estimates the accuracy of a classifier on unseen questions
+
+    Args:
+        questions(list/tuple): The questions to learn from
+        labels(list/tuple): The datatype of each question
+        folds(int): Number of folds
+
+    Returns:
+        The accuracy averaged over every fold
+    """
+    predictions = [None] * len(questions)
+    for fold in range(folds):
+        test = [i for i in range(len(questions)) if i % folds == fold]
+        train = [i for i in range(len(questions)) if i % folds != fold]
+        classifier = Classifier.train([questions[i] for i in train], [labels[i] for i in train])
+        for i, prediction in zip(test, classifier.classify_many([questions[i] for i in test])):
+            predictions[i] = prediction
+    return accuracy(predictions, labels)
+
+
+def train(csv_file=TRAINING_DATA, path=MODEL):
+    """Retrains the model from the training data and saves it
+
+    Args:
+        csv_file(str): Path to the training data
+        path(str): Path to save the model to
+
+    Returns:
+        The trained Classifier
+    """
+    classifier = Classifier.train(*read_training_data(csv_file))
+    classifier.save(path)
+    return classifier
+
+
+def compare(csv_file=TRAINING_DATA, path=MODEL, pickle_path="model.pickle"):
+    """Compares the accuracy of the model with the pickled TextBlob model
+
+    Only questions with a datatype that the TextBlob model can predict
+    are used for the comparison.
+
+    Args:
+        csv_file(str): Path to the training data
+        path(str): Path to the .npz model
+        pickle_path(str): Path to the pickled TextBlob model
+
+    Returns:
+        A dictionary mapping each measurement to its accuracy
+    """
+    questions, labels = read_training_data(csv_file)
+    results = {"Cross-validated": cross_validate(questions, labels)}
+
+    with open(pickle_path, "rb") as pick:
+        old = pickle.load(pick)
+    pairs = [(q, l) for q, l in zip(questions, labels) if l in old.labels()]
+    shared_questions, shared_labels = [q for q, l in pairs], [l for q, l in pairs]
+    results["New model"] = accuracy(Classifier.load(path).classify_many(shared_questions), shared_labels)
+    try:
+        results["TextBlob model"] = accuracy([old.classify(q) for q in shared_questions], shared_labels)
+    except Exception as e:  # TextBlob needs the NLTK corpora in nltk.txt
+        results["TextBlob model"] = f"unavailable ({type(e).__name__})"
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trains the question classifier.")
+    parser.add_argument("command", choices=("train", "compare"))
+    parser.add_argument("--data", default=TRAINING_DATA, help="path to the training data")
+    parser.add_argument("--model", default=MODEL, help="path to the .npz model")
+    args = parser.parse_args()
+    if args.command == "train":
+        trained = train(args.data, args.model)
+        print(f"Saved {args.model} ({', '.join(trained.labels)})")
+    else:
+        for measurement, value in compare(args.data, args.model).items():
+            print(f"{measurement}: {value}")
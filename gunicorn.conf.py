@@ -0,0 +1,49 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Configures gunicorn.
+
+The app is loaded and warmed up once in the master process, before the
+workers are forked, so that the libraries, the stopwords and the
+predictor that every worker needs are shared between them copy-on-write
+instead of being loaded again by every worker on its first requests.
+
+Usage:
+    gunicorn -c gunicorn.conf.py main:app
+"""
+# Imports
+import gc
+
+# The bind address and number of workers default to $PORT and $WEB_CONCURRENCY
+preload_app = True
+
+
+def when_ready(server):
+    """Warms the app up in the master process, before any worker is forked"""
+    import analyse
+
+    analyse.warm_up()
+    # Objects loaded so far are never collected, so collections in the
+    # workers do not write to, and so copy, the pages they are shared in
+    gc.freeze()
+    server.log.info("Warmed up")
@@ -0,0 +1,269 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Runs analyses in the background.
+
+This module contains the job queue that analyses uploaded surveys and
+generates their reports outside of the request that uploaded them. The
+status of every job is written to the analysis store, so that any web
+worker can report its progress, and is written again every few seconds
+while the job is queued or running, so that a job whose worker died can
+be told apart from a slow one.
+"""
+# Imports
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from time import perf_counter, sleep, time
+
+import analyse
+import metrics
+from utils import CHUNK_SIZE
+
+HEARTBEAT = 10
+# Seconds after which a job whose status is no longer written is reported as failed
+STALE = 6 * HEARTBEAT
+
+
+class JobQueue(object):
+    """Pool of background workers analysing surveys
+
+    Every job is identified by the id of its upload folder. Its status is
+    a dictionary such as:
+    {"State": "running", "Done": 3, "Total": 12, "Question": "Class",
+    "File": "responses.xlsx", "Config": "config_file.txt", "Heartbeat": 1571234567.8}
+    where State is either "queued", "running", "done" or "failed", and
+    Heartbeat is when the status of a queued or running job was last written.
+    """
+
+    def __init__(
+        self,
+        store,
+        workers=2,
+        analysis_workers=1,
+        cache=None,
+        chunk_size=CHUNK_SIZE,
+        approximate=False,
+        logger=None,
+    ):
+        """Creates a job queue
+
+        Args:
+            store(AnalysisStore): store to write analyses and statuses to
+            workers(int): number of surveys analysed at the same time
+            analysis_workers(int): number of processes each survey is
+                analysed in, see analyse.analyse()
+            cache(AnalysisCache): cache passed on to analyse.analyse()
+            chunk_size(int): number of rows of a csv file to parse at a
+                time, passed on to analyse.analyse()
+            approximate(bool): whether to analyse surveys approximately,
+                passed on to analyse.analyse()
+            logger(logging.Logger): logger to log the time taken by each
+                stage of every job to, if any
+        """
+        self.store = store
+        self.analysis_workers = analysis_workers
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.approximate = approximate
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Statuses of the queued and running jobs, whose heartbeat is kept up
+        self._active = {}
+        self._lock = Lock()
+        self._heart = None
+
+    def _put_status(self, job_id, status):
+        """Writes the status of a job, and keeps it beating while the job is queued or running"""
+        with self._lock:
+            if status["State"] in ("queued", "running"):
+                status["Heartbeat"] = time()
+                self._active[job_id] = status
+                if self._heart is None:
+                    # Started in the worker that runs the jobs, as threads do not survive a fork
+                    self._heart = Thread(target=self._beat, daemon=True)
+                    self._heart.start()
+            else:
+                status.pop("Heartbeat", None)
+                self._active.pop(job_id, None)
+            self.store.put_status(job_id, dict(status))
+
+    def _beat(self):
+        """Writes the status of every queued or running job every HEARTBEAT seconds"""
+        while True:
+            sleep(HEARTBEAT)
+            with self._lock:
+                for job_id, status in self._active.items():
+                    status["Heartbeat"] = time()
+                    try:
+                        self.store.put_status(job_id, dict(status))
+                    except Exception:
+                        if self.logger:
+                            self.logger.exception(f"Job {job_id} heartbeat failed")
+
+    def submit(self, directory, survey_file, config_file):
+        """Queues the analysis of a survey
+
+        Args:
+            directory(str): path to the folder containing the excel file and config file
+                For example: "./static/uploads/4SikvVjjqlWV44AW/"
+            survey_file(str): name of survey file (excel/csv)
+                For example: "responses.xlsx" or "responses.csv"
+            config_file(str): name of config file
+                For example: "config_file.txt"
+
+        Returns:
+            The id of the job
+            For example: "4SikvVjjqlWV44AW"
+        """
+        job_id = os.path.basename(os.path.normpath(directory))
+        self._put_status(
+            job_id,
+            {"State": "queued", "Done": 0, "Total": None, "File": survey_file, "Config": config_file},
+        )
+        self.executor.submit(self.run, job_id, directory, survey_file, config_file)
+        return job_id
+
+    def append(self, directory, delta_file):
+        """Queues merging new responses into the analysis of a survey
+
+        Args:
+            directory(str): path to the folder of an analysed survey, which
+                also contains the new responses
+                For example: "./static/uploads/4SikvVjjqlWV44AW/"
+            delta_file(str): name of the survey file (excel/csv) containing
+                the new responses
+                For example: "week2.xlsx"
+
+        Returns:
+            The id of the job
+            For example: "4SikvVjjqlWV44AW"
+        """
+        job_id = os.path.basename(os.path.normpath(directory))
+        status = self.status(job_id)
+        # The report of the old responses is still downloaded until the new one is ready
+        self._put_status(
+            job_id,
+            {"State": "queued", "Done": 0, "Total": None, "File": status["File"], "Config": status["Config"],
+             "Report": status.get("Report")},
+        )
+        self.executor.submit(self.run, job_id, directory, status["File"], status["Config"], delta_file, status)
+        return job_id
+
+    def status(self, job_id):
+        """Returns the status of a job, or None if there is no such job
+
+        A job that is queued or running, but whose heartbeat stopped more
+        than STALE seconds ago, was in a worker that died, such as one
+        killed by a timeout or a deploy, and is reported as failed. If it
+        was adding responses to an analysis, that analysis is still intact,
+        and is reported as done with the error as AppendError.
+        """
+        status = self.store.get_status(job_id)
+        if status and status["State"] in ("queued", "running") and time() - status.get("Heartbeat", 0) > STALE:
+            error = "The analysis stopped unexpectedly, perhaps because the server restarted"
+            if self.store.get(job_id) is not None:
+                return dict(status, State="done", AppendError=error)
+            return dict(status, State="failed", Error=error)
+        return status
+
+    def run(self, job_id, directory, survey_file, config_file, delta_file=None, previous=None):
+        """Analyses a survey and generates its report
+
+        Args:
+            job_id(str): id of the job
+            directory(str): path to the folder containing the excel file and config file
+            survey_file(str): name of survey file (excel/csv)
+            config_file(str): name of config file
+            delta_file(str): name of a survey file (excel/csv) containing new
+                responses to merge into the analysis of survey_file
+            previous(dict): status of the analysis that the new responses
+                are merged into. Its report and word clouds are removed once
+                the merged analysis has been stored. If merging fails, the analysis is left
+                as it was, and the error is added to this status as AppendError.
+        """
+        status = {"State": "running", "Done": 0, "Total": None, "File": survey_file, "Config": config_file}
+        if previous:
+            status["Report"] = previous.get("Report")
+        self._put_status(job_id, status)
+        start, breakdown = perf_counter(), metrics.start_breakdown()
+
+        def progress(done, total, question):
+            status.update(Done=done, Total=total, Question=question)
+            self._put_status(job_id, status)
+
+        try:
+            aggregates = self.store.get_aggregates(job_id) if delta_file else None
+            if aggregates is None:
+                aggregates = {}
+                analysis = analyse.analyse(
+                    directory,
+                    survey_file,
+                    config_file,
+                    workers=self.analysis_workers,
+                    cache=self.cache,
+                    progress=progress,
+                    chunk_size=self.chunk_size,
+                    aggregates=aggregates,
+                    approximate=self.approximate,
+                )
+            else:
+                analysis = self.store.get(job_id)
+            # Files of the old analysis, deleted once it has been replaced
+            stale = [(previous or {}).get("Report")]
+            if delta_file:
+                analysis, clouds = analyse.merge(
+                    directory,
+                    delta_file,
+                    config_file,
+                    analysis,
+                    aggregates,
+                    workers=self.analysis_workers,
+                    progress=progress,
+                    chunk_size=self.chunk_size,
+                    approximate=self.approximate,
+                )
+                stale.extend(clouds)
+            # Nothing is stored until the report has been generated too
+            status["Report"] = analyse.generate_report(directory, analysis, survey_file)
+            self.store.put(job_id, analysis)
+            self.store.put_aggregates(job_id, aggregates)
+            for path in stale:
+                if path and os.path.exists(path):
+                    os.remove(path)
+        except ValueError:
+            status.update(State="failed", Error="ValueError! Perhaps you chose a wrong category for your data")
+        except Exception as e:
+            status.update(State="failed", Error=f"Unknown error: {str(e)}")
+        else:
+            status["State"] = "done"
+        if status["State"] == "failed" and previous:
+            # The analysis of the old responses is still intact
+            status = dict(previous, State="done", AppendError=status["Error"])
+        seconds, breakdown = perf_counter() - start, metrics.stop_breakdown(breakdown)
+        metrics.record("job", seconds, state=status["State"])
+        if self.logger:
+            self.logger.info(
+                f"Job {job_id} {status['State']} {seconds:.3f}s {metrics.format_breakdown(breakdown)}".rstrip()
+            )
+        self._put_status(job_id, status)
@@ -22,20 +22,60 @@
 # ================================================================================
 
 # Imports
+import json
+import logging
 import os
-import zipfile
+import shutil
+from time import perf_counter
 
-from flask import Flask, render_template, request, redirect, url_for, send_file, session
+from flask import (
+    Flask, Response, render_template, request, redirect, url_for, send_file, session, abort,
+    jsonify, g,
+)
 from werkzeug.utils import secure_filename
 
 import analyse
+import metrics
 import utils
+from cache import AnalysisCache
+from jobs import JobQueue
+from store import open_store
 
 app = Flask("app")
 app.config["UPLOAD_FOLDER"] = "./static/uploads/"
 app.config["SECRET_KEY"] = "bruh"
+# Percentages are sorted by value, and questions are in the order of the survey
+app.config["JSON_SORT_KEYS"] = False
+app.config["ANALYSIS_WORKERS"] = int(os.environ.get("ANALYSIS_WORKERS", os.cpu_count() or 1))
+app.config["ANALYSIS_JOBS"] = int(os.environ.get("ANALYSIS_JOBS", 2))
+app.config["CACHE_FOLDER"] = "./cache/"
+app.config["CACHE_SIZE"] = int(os.environ.get("CACHE_SIZE", 256 * 1024 ** 2))
+# Analyses are kept outside of static/, so that they are not served
+app.config["ANALYSIS_FOLDER"] = "./analyses/"
+app.config["ANALYSIS_STORE"] = os.environ.get(
+    "ANALYSIS_STORE", f"file:{app.config['ANALYSIS_FOLDER']}"
+)
+app.config["CSV_CHUNK_SIZE"] = int(os.environ.get("CSV_CHUNK_SIZE", utils.CHUNK_SIZE))
+app.config["APPROXIMATE_ANALYSIS"] = os.environ.get("APPROXIMATE_ANALYSIS", "") not in ("", "0")
+app.config["TIMING_LOGS"] = os.environ.get("TIMING_LOGS", "") not in ("", "0")
+if app.config["TIMING_LOGS"]:
+    app.logger.setLevel(logging.INFO)
+app.config["WARM_UP"] = os.environ.get("WARM_UP", "") not in ("", "0")
+if app.config["WARM_UP"]:
+    analyse.warm_up()
 if not os.path.exists(app.config["UPLOAD_FOLDER"]):
     os.mkdir(app.config["UPLOAD_FOLDER"])
+cache = AnalysisCache(app.config["CACHE_FOLDER"], app.config["CACHE_SIZE"])
+store = open_store(app.config["ANALYSIS_STORE"])
+jobs = JobQueue(
+    store,
+    workers=app.config["ANALYSIS_JOBS"],
+    analysis_workers=app.config["ANALYSIS_WORKERS"],
+    cache=cache,
+    chunk_size=app.config["CSV_CHUNK_SIZE"],
+    approximate=app.config["APPROXIMATE_ANALYSIS"],
+    logger=app.logger if app.config["TIMING_LOGS"] else None,
+)
 
 
 def save_file(directory=None, survey_file=None, config_file=None):
@@ -75,6 +115,24 @@ def save_file(directory=None, survey_file=None, config_file=None):
     return output
 
 
+@app.before_request
+def start_timer():
+    g.start = perf_counter()
+    g.breakdown = metrics.start_breakdown()
+
+
+@app.after_request
+def stop_timer(response):
+    seconds = perf_counter() - g.start
+    breakdown = metrics.format_breakdown(metrics.stop_breakdown(g.breakdown))
+    metrics.REGISTRY.observe("request_seconds", seconds, endpoint=request.endpoint or "")
+    if app.config["TIMING_LOGS"]:
+        app.logger.info(
+            f"{request.method} {request.path} {response.status_code} {seconds:.3f}s {breakdown}".rstrip()
+        )
+    return response
+
+
 @app.route("/", methods=["GET", "POST"])
 def main():  # Homepage
     return render_template("upload.html")
@@ -127,23 +185,19 @@ def analysis_page():
             directory, filename = os.path.split(survey_file)
             config_filename = os.path.basename(config)
 
-        if filename.endswith(".xlsx"):
-            questions = list(
-                utils.parse_excel(os.path.join(directory, filename)).keys()
-            )
-        else:
-            questions = list(utils.parse_csv(os.path.join(directory, filename)).keys())
+        with metrics.timed("list_questions"):
+            questions = utils.list_questions(os.path.join(directory, filename))
         types = utils.parse_config(os.path.join(directory, config_filename))
 
         # Excel but incomplete config
         if len(questions) != len(types):
             session["TEMP_FOLDER"] = directory
-            predictor = utils.Predictor()
+            missing = [qn for i, qn in enumerate(questions) if i + 1 not in types.keys()]
+            predictions = iter(utils.get_predictor().predict(missing))
             qn_dict = {}
             for i, qn in enumerate(questions):
                 if i + 1 not in types.keys():
-                    datatype = predictor.predict([qn])
-                    qn_dict[i + 1] = (qn, datatype[0])
+                    qn_dict[i + 1] = (qn, next(predictions))
                 else:
                     qn_dict[i + 1] = (qn, types[i + 1])
             questions_index = [(i[0], i[1][0], i[1][1]) for i in qn_dict.items()]
@@ -151,54 +205,8 @@ def analysis_page():
             return render_template("config.html", questions=questions_index, error=None)
 
         # Start analysis
-        try:
-            session["ANALYSIS"] = analyse.analyse(directory, filename, config_filename)
-        except ValueError as e:
-            return render_template(
-                "error.html",
-                error="ValueError! Perhaps you chose a wrong category for your data",
-                error_no="500",
-                error_message=error_messages[500],
-            )
-        except Exception as e:
-            return render_template(
-                "error.html",
-                error=f"Unknown error: {str(e)}",
-                error_no="500",
-                error_message=error_messages[500],
-            )
-
-        graphs, clouds, numerical = [], [], []
-        for question, analysis in session["ANALYSIS"].items():
-            if analysis:
-                if analysis[0] == "categorical":
-                    graphs.append(
-                        [
-                            question,
-                            utils.pie(
-                                question,
-                                [x for x in analysis[1]["Percentages"].keys()],
-                                [y for y in analysis[1]["Percentages"].values()],
-                            ),
-                        ]
-                    )
-                elif analysis[0] == "openended":
-                    clouds.append([question, analysis[1]])
-                elif analysis[0] == "numerical":
-                    numerical.append([question, analysis[1]])
-
-        graphs = tuple(utils.chunk(graphs, 3))
-        clouds = tuple(utils.chunk(clouds, 2))
-        numerical = tuple(utils.chunk(numerical, 4))
-
-        return render_template(
-            "analysis.html",
-            graphs=graphs,
-            clouds=clouds,
-            numerical=numerical,
-            filename=filename,
-            path=os.path.split(directory)[1],
-        )
+        job_id = jobs.submit(directory, filename, config_filename)
+        return redirect(url_for("job_page", job_id=job_id))
     elif not request.files["file"]:  # No excel
         return render_template("upload.html", error="Missing Excel/CSV file!")
 
@@ -206,13 +214,9 @@ def analysis_page():
         save = save_file(survey_file=request.files["file"])
         directory, filename = save["Directory"], save["File"]
         session["TEMP_FOLDER"] = directory
-        if filename.endswith(".xlsx"):
-            questions = list(
-                utils.parse_excel(os.path.join(directory, filename)).keys()
-            )
-        else:
-            questions = list(utils.parse_csv(os.path.join(directory, filename)).keys())
-        predictions = utils.Predictor().predict(questions)
+        with metrics.timed("list_questions"):
+            questions = utils.list_questions(os.path.join(directory, filename))
+        predictions = utils.get_predictor().predict(questions)
         questions_index = [
             (i + 1, question, predictions[i]) for i, question in enumerate(questions)
         ]
@@ -220,24 +224,118 @@ def analysis_page():
         return render_template("config.html", questions=questions_index, error=None)
 
 
-@app.route("/download/<path>")
-def download(path):
-    doc = analyse.generate_report(
-        os.path.join("./static/uploads/", path), session["ANALYSIS"]
-    )
-    filenames = [i[1] for i in session["ANALYSIS"].values() if i if i[0] == "openended"]
-    download_path = os.path.join("./static/uploads/", path, f"{utils.secure(4)}.zip")
+@app.route("/jobs/<job_id>")
+def job_page(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        abort(404)
+    if status["State"] == "done":
+        return redirect(url_for("results_page", analysis_id=job_id))
+    elif status["State"] == "failed":
+        return render_template(
+            "error.html",
+            error=status["Error"],
+            error_no="500",
+            error_message=error_messages[500],
+        )
+    return render_template("progress.html", job_id=job_id, status=status)
+
+
+@app.route("/jobs/<job_id>/status")
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return jsonify({"State": "missing"}), 404
+    return jsonify(status)
+
+
+@app.route("/results/<analysis_id>")
+def results_page(analysis_id):
+    analysis_result = store.get(analysis_id)
+    if analysis_result is None:
+        abort(404)
+    status = jobs.status(analysis_id) or {}
+
+    graphs, charts, clouds, numerical = [], [], [], []
+    for number, (question, analysis) in enumerate(analysis_result.items(), 1):
+        if analysis:
+            note = analyse.error_note(analysis[2]) if len(analysis) > 2 else None
+            if analysis[0] == "categorical":
+                graphs.append([question, len(charts), note])
+                charts.append(
+                    utils.pie_spec(
+                        question,
+                        [x for x in analysis[1]["Percentages"].keys()],
+                        [y for y in analysis[1]["Percentages"].values()],
+                    )
+                )
+            elif analysis[0] == "openended":
+                if not isinstance(analysis[1], str):
+                    # Analysed through the api, so the word cloud is rendered on request
+                    clouds.append([question, url_for("api_cloud", analysis_id=analysis_id, number=number), note])
+                    continue
+                clouds.append([question, analysis[1], note])
+            elif analysis[0] == "numerical":
+                numerical.append([question, analysis[1], note])
+
+    graphs = tuple(utils.chunk(graphs, 3))
+    clouds = tuple(utils.chunk(clouds, 2))
+    numerical = tuple(utils.chunk(numerical, 4))
+
+    with metrics.timed("render_template"):
+        return render_template(
+            "analysis.html",
+            graphs=graphs,
+            charts=charts,
+            clouds=clouds,
+            numerical=numerical,
+            filename=status.get("File"),
+            path=analysis_id,
+            append_error=status.get("AppendError"),
+        )
+
+
+@app.route("/append/<analysis_id>", methods=["POST"])
+def append_page(analysis_id):
+    status = jobs.status(analysis_id)
+    if status is None or store.get(analysis_id) is None:
+        abort(404)
+    if "Config" not in status:
+        abort(410)
+    if status["State"] != "done" or not request.files.get("file"):
+        return redirect(url_for("job_page", job_id=analysis_id))
+    # The new responses must not overwrite the survey file
+    filename = f"{utils.secure(8)}_{secure_filename(request.files['file'].filename)}"
+    directory = os.path.join(app.config["UPLOAD_FOLDER"], analysis_id)
+    request.files["file"].save(os.path.join(directory, filename))
+    job_id = jobs.append(directory, filename)
+    return redirect(url_for("job_page", job_id=job_id))
 
-    with zipfile.ZipFile(download_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for i in filenames:
-            zipf.write(i, os.path.basename(i))
-        zipf.write(doc, os.path.basename(doc))
 
-    return send_file(
-        download_path,
+@app.route("/download/<path>")
+def download(path):
+    analysis = store.get(path)
+    if analysis is None:
+        abort(404)
+    directory = os.path.join(app.config["UPLOAD_FOLDER"], path)
+    status = store.get_status(path) or {}
+    doc = status.get("Report")
+    if not doc or not os.path.exists(doc):
+        # Generated once, and reused until the analysis changes
+        doc = analyse.generate_report(directory, analysis, status.get("File"))
+        if status.get("State") == "done":
+            status["Report"] = doc
+            store.put_status(path, status)
+    filenames = [
+        i[1] if isinstance(i[1], str) else analyse.cloud(directory, i[1], number)
+        for number, i in enumerate(analysis.values(), 1)
+        if i and i[0] == "openended"
+    ]
+
+    return Response(
+        utils.stream_zip(filenames + [doc]),
         mimetype="application/zip",
-        attachment_filename="report.zip",
-        as_attachment=True,
+        headers={"Content-Disposition": "attachment; filename=report.zip"},
     )
 
 
@@ -246,6 +344,162 @@ def faq():
     return render_template("faq.html")
 
 
+def api_error(error, status=400, **details):
+    """Returns an error of the api as JSON"""
+    return jsonify(dict(Error=error, **details)), status
+
+
+def api_analysis(analysis_id, analysis):
+    """Converts an analysis into the JSON returned by the api
+
+    Args:
+        analysis_id(str): id of the analysis
+        analysis(dict): analysis from analyse.analyse()
+
+    Returns:
+        A dictionary containing the id of the analysis and the analysis of
+        every question, such as:
+        {"Id": "4SikvVjjqlWV44AW", "Questions": [{"Number": 1,
+        "Question": "Do you like python?", "Type": "categorical",
+        "Result": {"Percentages": {"No": 0.5, "Yes": 0.5}},
+        "Chart": "/api/analyses/4SikvVjjqlWV44AW/charts/1"}]}
+        Openended questions have a "Cloud" instead of a "Chart", and
+        approximate analyses also have an "Error".
+    """
+    questions = []
+    for number, (question, analysed) in enumerate(analysis.items(), 1):
+        entry = {"Number": number, "Question": question, "Type": None, "Result": None}
+        if analysed:
+            entry.update(Type=analysed[0], Result=analysed[1])
+            if analysed[0] == "categorical":
+                entry["Chart"] = url_for("api_chart", analysis_id=analysis_id, number=number)
+            elif analysed[0] == "openended":
+                if isinstance(analysed[1], str):
+                    entry["Result"] = None
+                entry["Cloud"] = url_for("api_cloud", analysis_id=analysis_id, number=number)
+            if len(analysed) > 2:
+                entry["Error"] = analysed[2]
+        questions.append(entry)
+    return {"Id": analysis_id, "Questions": questions}
+
+
+def api_question(analysis_id, number, kind):
+    """Returns the question and analysis of a question of kind, or None if there is none"""
+    analysis = store.get(analysis_id)
+    if analysis is None or not 1 <= number <= len(analysis):
+        return None
+    question, analysed = list(analysis.items())[number - 1]
+    if not analysed or analysed[0] != kind:
+        return None
+    return question, analysed
+
+
+@app.route("/api/analyses", methods=["POST"])
+def api_analyse():
+    """Analyses a survey and returns the analysis as JSON
+
+    Takes the survey as "file", and either a config file as "config" or
+    the datatypes as "types", a JSON object mapping question numbers to
+    datatypes such as {"1": "categorical", "2": "openended"}. Word clouds
+    are only rendered if "clouds" is 1, and can otherwise be requested
+    from the url of their question, like the charts.
+    """
+    if not request.files.get("file"):
+        return api_error("Missing Excel/CSV file!")
+    if request.files.get("config"):
+        save = save_file(survey_file=request.files["file"], config_file=request.files["config"])
+    elif request.form.get("types"):
+        try:
+            types = {int(number): datatype for number, datatype in json.loads(request.form["types"]).items()}
+        except (ValueError, AttributeError):
+            return api_error("types must be a JSON object mapping question numbers to datatypes")
+        save = save_file(survey_file=request.files["file"])
+        save["Config"] = os.path.basename(utils.to_config(save["Directory"], types))
+    else:
+        return api_error("Missing config file or types!")
+    directory, filename, config_filename = save["Directory"], save["File"], save["Config"]
+    analysis_id = os.path.basename(os.path.normpath(directory))
+
+    try:
+        questions = utils.list_questions(os.path.join(directory, filename))
+        types = utils.parse_config(os.path.join(directory, config_filename))
+        if len(questions) != len(types):
+            missing = [(i + 1, qn) for i, qn in enumerate(questions) if i + 1 not in types]
+            predictions = utils.get_predictor().predict([qn for _, qn in missing])
+            shutil.rmtree(directory, ignore_errors=True)
+            return api_error(
+                "The types of some questions are missing",
+                Questions=[
+                    {"Number": number, "Question": qn, "Predicted": predicted}
+                    for (number, qn), predicted in zip(missing, predictions)
+                ],
+            )
+        aggregates = {}
+        analysis = analyse.analyse(
+            directory,
+            filename,
+            config_filename,
+            workers=app.config["ANALYSIS_WORKERS"],
+            cache=cache,
+            chunk_size=app.config["CSV_CHUNK_SIZE"],
+            aggregates=aggregates,
+            approximate=app.config["APPROXIMATE_ANALYSIS"],
+            clouds=request.form.get("clouds") == "1",
+        )
+    except utils.read_errors() as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        return api_error(f"{type(e).__name__}! The survey file could not be read: {e}")
+    except (TypeError, ValueError) as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        return api_error(f"{type(e).__name__}! Perhaps you chose a wrong category for your data: {e}")
+    store.put(analysis_id, analysis)
+    store.put_aggregates(analysis_id, aggregates)
+    store.put_status(
+        analysis_id,
+        {"State": "done", "Done": len(questions), "Total": len(questions), "File": filename,
+         "Config": config_filename},
+    )
+    return jsonify(api_analysis(analysis_id, analysis)), 201
+
+
+@app.route("/api/analyses/<analysis_id>")
+def api_results(analysis_id):
+    analysis = store.get(analysis_id)
+    if analysis is None:
+        return api_error("No such analysis", 404)
+    return jsonify(api_analysis(analysis_id, analysis))
+
+
+@app.route("/api/analyses/<analysis_id>/charts/<int:number>")
+def api_chart(analysis_id, number):
+    found = api_question(analysis_id, number, "categorical")
+    if found is None:
+        return api_error("No such categorical question", 404)
+    question, analysed = found
+    shares = analysed[1]["Percentages"]
+    return jsonify(utils.pie_spec(question, list(shares), list(shares.values())))
+
+
+@app.route("/api/analyses/<analysis_id>/clouds/<int:number>")
+def api_cloud(analysis_id, number):
+    found = api_question(analysis_id, number, "openended")
+    if found is None:
+        return api_error("No such openended question", 404)
+    analysed = found[1]
+    if isinstance(analysed[1], str):
+        return send_file(analysed[1], mimetype="image/png")
+    directory = os.path.join(app.config["UPLOAD_FOLDER"], analysis_id)
+    with metrics.timed("render_cloud"):
+        path = analyse.cloud(directory, analysed[1], number)
+    return send_file(path, mimetype="image/png")
+
+
+@app.route("/metrics")
+def metrics_page():
+    # Every worker has its own metrics, which are told apart by its pid
+    return Response(metrics.REGISTRY.render(pid=os.getpid()), mimetype="text/plain; version=0.0.4")
+
+
 # Error handling
 error_messages = {
     404: "Page not Found",
@@ -0,0 +1,244 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Measures where time is spent.
+
+This module contains a small registry of counters and summaries, which
+the hot paths of the app record their durations, sizes and cache hits
+in, and which main.py exposes in the Prometheus text format at /metrics.
+Every stage that is timed while a breakdown is being collected is also
+added to the breakdown, so that the stages of a single request or job
+can be logged together. Metrics are kept per process, and a process
+forked from one starts with none.
+"""
+# Imports
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+PREFIX = "surveyinator_"
+
+_breakdown = ContextVar("breakdown", default=None)
+
+
+class Registry(object):
+    """Thread-safe registry of counters and summaries
+
+    Every metric is identified by its name and labels. Summaries keep the
+    number of observations and their sum.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._summaries = {}
+        self._help = {}
+
+    def inc(self, name, amount=1, **labels):
+        """Increments a counter
+
+        Args:
+            name(str): Name of the counter, without the prefix
+            amount(int/float): Amount to increment the counter by
+            labels: Labels of the counter
+                For example: result="hit"
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Adds an observation to a summary
+
+        Args:
+            name(str): Name of the summary, without the prefix
+            value(int/float): Value observed
+            labels: Labels of the summary
+                For example: stage="load_survey"
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total = self._summaries.get(key, (0, 0))
+            self._summaries[key] = (count + 1, total + value)
+
+    def describe(self, name, text):
+        """Sets the help text of a metric"""
+        self._help[name] = text
+
+    def clear(self):
+        """Removes every metric, keeping their help texts"""
+        self._lock = Lock()
+        self._counters = {}
+        self._summaries = {}
+
+    def render(self, **labels):
+        """Renders every metric in the Prometheus text format
+
+        Args:
+            labels: Labels added to every metric
+                For example: pid=4242
+
+        Returns:
+            A string of the metrics
+
+        >>> registry = Registry()
+        >>> registry.inc("cache_total", cache="question", result="hit")
+        >>> print(registry.render(pid=4242), end="")
+        # TYPE surveyinator_cache_total counter
+        surveyinator_cache_total{cache="question",pid="4242",result="hit"} 1
+        """
+        with self._lock:
+            counters, summaries = dict(self._counters), dict(self._summaries)
+        lines = []
+        for kind, metrics in (("counter", counters), ("summary", summaries)):
+            for name in sorted({name for name, labels in metrics}):
+                if name in self._help:
+                    lines.append(f"# HELP {PREFIX}{name} {self._help[name]}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                for (metric, own), value in sorted(metrics.items()):
+                    if metric != name:
+                        continue
+                    formatted = format_labels(sorted(own + tuple(labels.items())))
+                    if kind == "counter":
+                        lines.append(f"{PREFIX}{name}{formatted} {value}")
+                    else:
+                        lines.append(f"{PREFIX}{name}_count{formatted} {value[0]}")
+                        lines.append(f"{PREFIX}{name}_sum{formatted} {value[1]}")
+        return "".join(f"{line}\n" for line in lines)
+
+
+def format_labels(labels):
+    """Formats labels for the Prometheus text format
+
+    >>> format_labels((("stage", 'say "hi"'),))
+    '{stage="say \\\\"hi\\\\""}'
+    """
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+REGISTRY = Registry()
+REGISTRY.describe("stage_seconds", "Seconds spent in each stage")
+REGISTRY.describe("survey_rows", "Responses in each survey analysed")
+REGISTRY.describe("survey_columns", "Questions parsed in each survey analysed")
+REGISTRY.describe("cache_total", "Cache lookups by cache and result")
+REGISTRY.describe("request_seconds", "Seconds spent handling each request, by endpoint")
+# Such as gunicorn workers, which would otherwise report what was recorded
+# in their master before they were forked on top of their own metrics
+os.register_at_fork(after_in_child=REGISTRY.clear)
+
+
+def record(stage, seconds, **labels):
+    """Records the duration of a stage
+
+    Args:
+        stage(str): Name of the stage
+            For example: "load_survey"
+        seconds(float): Duration of the stage
+        labels: Other labels of the stage
+            For example: category="openended"
+    """
+    REGISTRY.observe("stage_seconds", seconds, stage=stage, **labels)
+    stages = _breakdown.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Times the code in a with statement as a stage, see record()"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, perf_counter() - start, **labels)
+
+
+def timed_call(function, *args, **kwargs):
+    """Calls a function and times it
+
+    Used to time functions run in another process, which can not record
+    their own duration in this process.
+
+    Returns:
+        A tuple containing the seconds taken and the result of the function
+    """
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def lookup(cache, hits=0, misses=0):
+    """Counts lookups in a cache
+
+    Args:
+        cache(str): Name of the cache
+            For example: "predictor"
+        hits(int): Number of lookups that found an entry
+        misses(int): Number of lookups that did not
+    """
+    REGISTRY.inc("cache_total", hits, cache=cache, result="hit")
+    REGISTRY.inc("cache_total", misses, cache=cache, result="miss")
+
+
+def start_breakdown():
+    """Starts collecting the stages timed in the current context
+
+    Returns:
+        A token to pass to stop_breakdown()
+    """
+    return _breakdown.set([])
+
+
+def stop_breakdown(token):
+    """Stops collecting stages
+
+    Args:
+        token: Token from start_breakdown()
+
+    Returns:
+        A dictionary mapping every stage collected to its total duration
+        For example: {"load_survey": 0.21, "analyse_question": 1.305}
+    """
+    stages = _breakdown.get() or []
+    _breakdown.reset(token)
+    totals = {}
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0) + seconds
+    return totals
+
+
+def format_breakdown(totals):
+    """Formats the durations from stop_breakdown() for logging
+
+    >>> format_breakdown({"load_survey": 0.21, "analyse_question": 1.305})
+    'load_survey=0.210s analyse_question=1.305s'
+    """
+    return " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in totals.items())
@@ -0,0 +1,254 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Stores analyses on the server.
+
+This module contains the stores that keep analyses, the counts of the
+responses they were computed from and the status of the jobs computing
+them, keyed by the id of their upload folder, which is the id in the urls
+of an analysis. Stores are opened from a URI, for example
+"file:./analyses/" or "sqlite:./analyses.db".
+"""
+# Imports
+import json
+import os
+import pickle
+import sqlite3
+from contextlib import closing
+
+
+class AnalysisStore(object):
+    """Base class of the stores, keyed by the id of an upload folder"""
+
+    def get(self, key):
+        """Reads an analysis
+
+        Args:
+            key(str): id of the upload folder
+                For example: "4SikvVjjqlWV44AW"
+
+        Returns:
+            The analysis, or None if there is no analysis for key
+        """
+        raise NotImplementedError
+
+    def put(self, key, analysis):
+        """Writes an analysis
+
+        Args:
+            key(str): id of the upload folder
+                For example: "4SikvVjjqlWV44AW"
+            analysis(dict): analysis from analyse.analyse()
+        """
+        raise NotImplementedError
+
+    def get_aggregates(self, key):
+        """Reads the counts of the responses of an analysis
+
+        Args:
+            key(str): id of the upload folder
+                For example: "4SikvVjjqlWV44AW"
+
+        Returns:
+            The counts, or None if there are no counts for key
+        """
+        raise NotImplementedError
+
+    def put_aggregates(self, key, aggregates):
+        """Writes the counts of the responses of an analysis
+
+        Args:
+            key(str): id of the upload folder
+                For example: "4SikvVjjqlWV44AW"
+            aggregates(dict): counts filled in by analyse.analyse()
+        """
+        raise NotImplementedError
+
+    def get_status(self, key):
+        """Reads the status of the analysis job of an upload folder
+
+        Args:
+            key(str): id of the upload folder
+                For example: "4SikvVjjqlWV44AW"
+
+        Returns:
+            The status, or None if there is no job for key
+        """
+        raise NotImplementedError
+
+    def put_status(self, key, status):
+        """Writes the status of the analysis job of an upload folder
+
+        Args:
+            key(str): id of the upload folder
+                For example: "4SikvVjjqlWV44AW"
+            status(dict): status from jobs.JobQueue
+        """
+        raise NotImplementedError
+
+
+class FileStore(AnalysisStore):
+    """Store that pickles each analysis into a folder named after its upload folder"""
+
+    def __init__(self, directory):
+        """Creates a store
+
+        Args:
+            directory(str): Directory to keep the analyses in, which should
+                not be served, unlike the upload folders
+                For example: "./analyses/"
+        """
+        self.directory = directory
+
+    def _path(self, key, name="analysis.pickle"):
+        if not key.isalnum():
+            raise KeyError(f"Invalid analysis id '{key}'")
+        return os.path.join(self.directory, key, name)
+
+    def _load(self, key, name):
+        try:
+            with open(self._path(key, name), "rb") as f:
+                return pickle.load(f)
+        except (KeyError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _dump(self, key, value, name):
+        path = self._path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(value, f)
+        os.replace(f"{path}.tmp", path)
+
+    def get(self, key):
+        return self._load(key, "analysis.pickle")
+
+    def put(self, key, analysis):
+        self._dump(key, analysis, "analysis.pickle")
+
+    def get_aggregates(self, key):
+        return self._load(key, "aggregates.pickle")
+
+    def put_aggregates(self, key, aggregates):
+        self._dump(key, aggregates, "aggregates.pickle")
+
+    def get_status(self, key):
+        try:
+            with open(self._path(key, "status.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def put_status(self, key, status):
+        path = self._path(key, "status.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(status, f)
+        os.replace(f"{path}.tmp", path)
+
+
+class SQLiteStore(AnalysisStore):
+    """Store that keeps every analysis in a single SQLite database"""
+
+    def __init__(self, path):
+        """Creates a store
+
+        Args:
+            path(str): Path to the database file
+        """
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS analyses (id TEXT PRIMARY KEY, analysis BLOB)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS statuses (id TEXT PRIMARY KEY, status TEXT)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS aggregates (id TEXT PRIMARY KEY, aggregates BLOB)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT analysis FROM analyses WHERE id = ?", (key,)
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def put(self, key, analysis):
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO analyses (id, analysis) VALUES (?, ?)",
+                (key, pickle.dumps(analysis)),
+            )
+
+    def get_aggregates(self, key):
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT aggregates FROM aggregates WHERE id = ?", (key,)
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def put_aggregates(self, key, aggregates):
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO aggregates (id, aggregates) VALUES (?, ?)",
+                (key, pickle.dumps(aggregates)),
+            )
+
+    def get_status(self, key):
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT status FROM statuses WHERE id = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_status(self, key, status):
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO statuses (id, status) VALUES (?, ?)",
+                (key, json.dumps(status)),
+            )
+
+
+def open_store(uri):
+    """Opens a store from its URI
+
+    Args:
+        uri(str): "file:<directory>" or "sqlite:<path>"
+            For example: "file:./analyses/"
+
+    Returns:
+        The AnalysisStore described by uri
+
+    Raises:
+        ValueError: Store not supported
+    """
+    scheme, _, location = uri.partition(":")
+    if scheme == "file":
+        return FileStore(location)
+    elif scheme == "sqlite":
+        return SQLiteStore(location)
+    raise ValueError(f"Store '{uri}': open_store only accepts file:<directory> or sqlite:<path>")
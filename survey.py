@@ -0,0 +1,368 @@
+# MIT License
+#
+# Copyright (c) 2019 Loh Yu Chen & Chi Junxiang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================================
+
+"""Stores survey responses by column.
+
+This module contains the compact, columnar representation of a survey
+that the parsers in utils.py produce and analyse.py consumes. Text
+responses are dictionary-encoded, so that every distinct response is
+only stored once, and numerical responses are kept in typed arrays.
+Surveys can be saved as a folder of .npy columns and memory-mapped back.
+"""
+# Imports
+import json
+import os
+from array import array
+from collections.abc import Mapping, Sequence
+from hashlib import sha256
+
+import numpy
+
+
+class Column(Sequence):
+    """Dictionary-encoded column of responses
+
+    Every distinct response is stored once in labels, in the order in
+    which it first appears, and every row is stored as an integer code
+    pointing into labels.
+
+    >>> column = encode(["Yes", "No", "Yes"])
+    >>> column.labels
+    ('Yes', 'No')
+    >>> column.codes.tolist()
+    [0, 1, 0]
+    >>> list(column)
+    ['Yes', 'No', 'Yes']
+    """
+
+    def __init__(self, codes, labels):
+        """Creates a column from codes and their labels
+
+        Args:
+            codes(numpy.ndarray): Integer code of each response
+            labels(tuple): The distinct responses, indexed by code
+        """
+        self.codes = codes
+        self.labels = tuple(labels)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.labels[code] for code in self.codes[index].tolist()]
+        return self.labels[self.codes[index]]
+
+    def __iter__(self):
+        labels = self.labels
+        for code in self.codes.tolist():
+            yield labels[code]
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Column({len(self)} responses, {len(self.labels)} labels)"
+
+    def fingerprint(self):
+        """Returns the bytes that identify the content of the column"""
+        digest = sha256(self.codes.astype(numpy.int32).tobytes())
+        for label in self.labels:
+            digest.update(label.encode("utf-8", "surrogatepass") + b"\0")
+        return digest.digest()
+
+    def counts(self):
+        """Counts the responses
+
+        Returns:
+            An array containing the number of responses for each label
+
+        >>> encode(["Yes", "No", "Yes"]).counts().tolist()
+        [2, 1]
+        """
+        return numpy.bincount(self.codes, minlength=len(self.labels))
+
+    def to_numerical(self):
+        """Converts the column into a numerical column
+
+        Every label is converted once, and the codes are then mapped to
+        the converted labels.
+
+        Returns:
+            A NumericalColumn containing the responses as integers
+
+        Raises:
+            ValueError: A response is not an integer
+
+        >>> encode(["1", "3", "1"]).to_numerical().values.tolist()
+        [1, 3, 1]
+        """
+        values = numpy.array([int(label) for label in self.labels], dtype=numpy.int64)
+        return NumericalColumn(values[self.codes])
+
+
+class NumericalColumn(Sequence):
+    """Column of numerical responses stored in a typed array"""
+
+    def __init__(self, values):
+        """Creates a column from an array of values
+
+        Args:
+            values(numpy.ndarray): The responses
+        """
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.values[index].tolist()
+        return self.values[index].item()
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"NumericalColumn({len(self)} responses)"
+
+    def fingerprint(self):
+        """Returns the bytes that identify the content of the column"""
+        return sha256(self.values.dtype.str.encode("ascii") + self.values.tobytes()).digest()
+
+
+class ColumnBuilder(object):
+    """Dictionary-encodes responses as they are appended"""
+
+    def __init__(self):
+        self._index = {}
+        self._codes = array("i")
+
+    def __len__(self):
+        return len(self._codes)
+
+    def append(self, response):
+        """Appends a response to the column
+
+        Args:
+            response(str): The response to be appended
+        """
+        code = self._index.get(response)
+        if code is None:
+            code = self._index[response] = len(self._index)
+        self._codes.append(code)
+
+    def extend(self, responses):
+        """Appends every response in an iterable to the column
+
+        Args:
+            responses(iterable): The responses to be appended
+        """
+        index, codes = self._index, self._codes
+        for response in responses:
+            code = index.get(response)
+            if code is None:
+                code = index[response] = len(index)
+            codes.append(code)
+
+    def build(self):
+        """Builds the column
+
+        Returns:
+            A Column containing the appended responses
+        """
+        return Column(numpy.frombuffer(self._codes, dtype=numpy.intc), self._index)
+
+
+class Survey(Mapping):
+    """Columnar survey mapping each question to its column of responses
+
+    A Survey behaves like the dictionaries that the parsers used to
+    return, so its columns can still be iterated over as responses.
+    A Survey may only contain some of the questions of its survey file,
+    so it also keeps every header and the number of each question.
+    """
+
+    def __init__(self, columns, numbers=None, headers=None):
+        """Creates a survey from its columns
+
+        Args:
+            columns(dict/list): The columns mapped to their question
+            numbers(dict/list): The question number of each column mapped
+                to its question. Defaults to the order of the columns.
+            headers(list): Every question in the survey file, including
+                the ones without a column. Defaults to the questions of
+                the columns.
+        """
+        self.columns = dict(columns)
+        if numbers is None:
+            numbers = [(question, i + 1) for i, question in enumerate(self.columns)]
+        self.numbers = dict(numbers)
+        self.headers = list(self.columns) if headers is None else list(headers)
+
+    def __getitem__(self, question):
+        return self.columns[question]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __repr__(self):
+        return f"Survey({len(self)} questions)"
+
+    def save(self, directory):
+        """Saves the survey as a folder of columns
+
+        Every column is saved as a .npy array of its codes or values, and
+        the labels of every column as a .json string table, next to a
+        manifest listing the questions.
+
+        Args:
+            directory(str): Folder to save the survey in. It must not exist yet.
+        """
+        os.mkdir(directory)
+        kinds = []
+        for i, column in enumerate(self.columns.values()):
+            if isinstance(column, NumericalColumn):
+                numpy.save(os.path.join(directory, f"{i}.npy"), column.values)
+                kinds.append("numerical")
+                continue
+            numpy.save(os.path.join(directory, f"{i}.npy"), numpy.asarray(column.codes, numpy.int32))
+            with open(os.path.join(directory, f"{i}.json"), "w", encoding="utf-8") as f:
+                json.dump(column.labels, f)
+            kinds.append("text")
+        with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "headers": self.headers,
+                    "questions": list(self.columns),
+                    "numbers": [self.numbers[question] for question in self.columns],
+                    "kinds": kinds,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """Loads a survey saved with save()
+
+        The arrays are memory-mapped, so that only the pages that are
+        actually used are read from disk.
+
+        Args:
+            directory(str): Folder the survey was saved in
+            mmap_mode(str): Mode to memory-map the arrays with, or None
+                to read them into memory
+
+        Returns:
+            The loaded Survey
+        """
+        manifest = read_manifest(directory)
+        columns = []
+        for i, (question, kind) in enumerate(zip(manifest["questions"], manifest["kinds"])):
+            array = numpy.load(os.path.join(directory, f"{i}.npy"), mmap_mode=mmap_mode)
+            if kind == "numerical":
+                columns.append((question, NumericalColumn(array)))
+                continue
+            with open(os.path.join(directory, f"{i}.json"), "r", encoding="utf-8") as f:
+                columns.append((question, Column(array, json.load(f))))
+        return cls(columns, zip(manifest["questions"], manifest["numbers"]), manifest["headers"])
+
+    def typed(self, datatypes):
+        """Converts the numerical columns of the survey
+
+        Args:
+            datatypes(dict): The datatypes of the responses
+                mapped to question number
+
+        Returns:
+            A Survey whose numerical questions are NumericalColumns
+
+        Raises:
+            ValueError: A numerical response is not an integer
+        """
+        columns = []
+        for question, column in self.columns.items():
+            if datatypes.get(self.numbers[question]) == "numerical" and isinstance(column, Column):
+                column = column.to_numerical()
+            columns.append((question, column))
+        return Survey(columns, self.numbers, self.headers)
+
+    def select(self, numbers):
+        """Selects some of the questions of the survey
+
+        Args:
+            numbers(iterable): The numbers of the questions to select
+
+        Returns:
+            A Survey containing only the selected questions
+        """
+        numbers = set(numbers)
+        selected = [q for q in self.columns if self.numbers[q] in numbers]
+        return Survey(
+            [(q, self.columns[q]) for q in selected],
+            [(q, self.numbers[q]) for q in selected],
+            self.headers,
+        )
+
+
+def read_manifest(directory):
+    """Reads the manifest of a survey saved with Survey.save()
+
+    Args:
+        directory(str): Folder the survey was saved in
+
+    Returns:
+        A dictionary containing every header of the survey file, and the
+        question, question number and kind of each saved column
+        For example:
+        {"headers": ["Timestamp", "Do you like python?"],
+        "questions": ["Do you like python?"], "numbers": [2], "kinds": ["text"]}
+    """
+    with open(os.path.join(directory, "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def encode(responses):
+    """Dictionary-encodes responses
+
+    Args:
+        responses(list/tuple): List/tuple of the responses
+            For example: ["Yes","No","Yes"] or ("Yes","No","Yes")
+
+    Returns:
+        A Column containing the responses
+    """
+    builder = ColumnBuilder()
+    for response in responses:
+        builder.append(response)
+    return builder.build()
@@ -25,24 +25,32 @@
 
 This module contains utility functions for main.py and analyse.py.
 Those functions are placed into this module to prevent spaghetti code in
-both of those scripts.
+both of those scripts. openpyxl, plotly and flask are only imported by
+the functions that use them, so that importing this module stays cheap.
 """
 # Imports
 import os
 import pickle
+import shutil
+import struct
+import zipfile
+from collections import OrderedDict
 from random import choices, choice
 from string import ascii_letters, digits
 from csv import reader
+from itertools import islice
+from threading import Lock
+from zlib import crc32
 
-import plotly
-from flask import Markup
-from openpyxl import load_workbook
-from openpyxl.utils.cell import get_column_letter
+import metrics
+from classifier import MODEL, Classifier
+from survey import ColumnBuilder, Survey, read_manifest
 
 global COLORS
 COLORS = ["#4e73df", "#6610f2", "#6f42c1", "#e83e8c", "#e74a3b", "#fd7e14", "#f6c23e", "#1cc88a", "#20c9a6",
           "#36b9cc"]
 COLORS = ["#0c1941", "#183281", "#2043ac", "#2854d7", "#4e73df"]
+CHUNK_SIZE = 10000
 
 
 # Misc
@@ -62,11 +70,14 @@ def secure(length):
 
 
 # File Utils
-def parse_csv(csv_file):
+def parse_csv(csv_file, datatypes=None, columns=None, header_only=False, chunk_size=CHUNK_SIZE):
     """Parses an csv file by column
 
     Parse the csv file, which has the responses to a survey,
-    represented by csv_file
+    represented by csv_file. The file is streamed chunk_size rows at a
+    time, so only one chunk of rows is ever held in memory besides the
+    encoded columns. Cells missing from rows shorter than the header are
+    skipped, and cells past the header are ignored.
 
     For example:
     Do you like python?,What other languages do you use?
@@ -76,22 +87,33 @@ def parse_csv(csv_file):
 
     Args:
         csv_file(str): The file name of the excel_file to be parsed
+        datatypes(dict): The datatypes of the responses mapped to question
+            number. Numerical questions are converted to typed arrays.
+        columns(iterable): The numbers of the questions to parse. Defaults
+            to every question.
+        header_only(bool): Whether to only read the questions
+        chunk_size(int): The number of rows to read at a time
 
     Returns:
-        A dictionary mapping the question to a tuple of responses
+        A Survey mapping the question to a column of responses, or a list
+        of the questions if header_only is True
         For example:
         {"Do you like Python?": ("Yes","No","Yes"),
         "What other languages do you use?": ("Go","Java","C++")}
     """
     with open(csv_file, "r") as f:
-        rows = list(reader(f, delimiter=','))
-        responses = []
-        for i, header in enumerate(rows[0]):
-            responses.append((header, [row[i] for row in rows[1:]]))
-    return dict(responses)
-
-
-def parse_excel(excel_file):
+        rows = reader(f, delimiter=',')
+        headers = next(rows, [])
+        if header_only:
+            return headers
+        builders = [(i, ColumnBuilder()) for i in projection(headers, columns)]
+        for batch in chunk(rows, chunk_size):
+            for i, builder in builders:
+                builder.extend(row[i] for row in batch if i < len(row))
+    return build_survey(headers, builders, datatypes)
+
+
+def parse_excel(excel_file, datatypes=None, columns=None, header_only=False):
     """Parses an Excel file by column
 
     Parse the Excel file, which has the responses to a survey,
@@ -106,26 +128,216 @@ def parse_excel(excel_file):
 
     Args:
         excel_file(str): The file name of the excel_file to be parsed
+        datatypes(dict): The datatypes of the responses mapped to question
+            number. Numerical questions are converted to typed arrays.
+        columns(iterable): The numbers of the questions to parse. Defaults
+            to every question.
+        header_only(bool): Whether to only read the questions
 
     Returns:
-        A dictionary mapping the question to a tuple of responses
+        A Survey mapping the question to a column of responses, or a list
+        of the questions if header_only is True
         For example:
         {"Do you like Python?": ("Yes", "No", "Yes")}
 
     Raises:
         KeyError: Question not present in column {i+1}
     """
-    wb = load_workbook(excel_file)
-    ws = wb.active
-    cell_values = []
-    for i, col in enumerate(ws.columns):
-        if col[0].value:
-            cell_values.append(
-                [str(cell.value) for cell in col if cell.value is not None]
-            )
-        else:
+    rows = iter_excel(excel_file)
+    headers = next(rows, ())
+    for i, header in enumerate(headers):
+        if not header:
+            from openpyxl.utils.cell import get_column_letter
+
             raise KeyError(f"Question not present in column {get_column_letter(i + 1)}")
-    return dict([(col[0], col[1:]) for col in cell_values])
+    headers = [str(header) for header in headers]
+    if header_only:
+        rows.close()
+        return headers
+    builders = [(i, ColumnBuilder()) for i in projection(headers, columns)]
+    for row in rows:
+        for i, builder in builders:
+            if i < len(row) and row[i] is not None:
+                builder.append(str(row[i]))
+    return build_survey(headers, builders, datatypes)
+
+
+def projection(headers, columns):
+    """Returns the indices of the columns to parse
+
+    Args:
+        headers(list): Every question in the survey file
+        columns(iterable): The numbers of the questions to parse, or None
+            to parse every question
+
+    Returns:
+        A sorted list of the 0-based indices of the columns to parse
+
+    >>> projection(["Timestamp", "Name", "Class"], [3, 1])
+    [0, 2]
+    """
+    if columns is None:
+        return list(range(len(headers)))
+    return sorted(n - 1 for n in set(columns) if 0 < n <= len(headers))
+
+
+def build_survey(headers, builders, datatypes=None):
+    """Builds a Survey from the builders of its columns
+
+    Args:
+        headers(list): Every question in the survey file
+        builders(list): Tuples of the index of a column and its ColumnBuilder
+        datatypes(dict): The datatypes of the responses mapped to question
+            number. Numerical questions are converted to typed arrays.
+
+    Returns:
+        A Survey mapping the question to a column of responses
+    """
+    survey = Survey(
+        [(headers[i], builder.build()) for i, builder in builders],
+        [(headers[i], i + 1) for i, builder in builders],
+        headers,
+    )
+    return survey.typed(datatypes) if datatypes else survey
+
+
+def iter_excel(excel_file):
+    """Iterates over the rows of an Excel file
+
+    Opens the Excel file in read-only mode and yields the values of
+    its active sheet row by row, so that only one row is held in
+    memory at a time. Every row is read, even if the file states a
+    smaller size for the sheet, as some exporters do.
+
+    Args:
+        excel_file(str): The file name of the excel_file to be read
+
+    Yields:
+        A tuple containing the values of one row
+        For example:
+        ("Do you like python?", "What other languages do you use?")
+
+    >>> import os, tempfile
+    >>> from openpyxl import Workbook
+    >>> wb = Workbook()
+    >>> wb.active.append(["Name", "Class"])
+    >>> wb.active.append(["Ann", "3A"])
+    >>> wb.active.calculate_dimension = lambda: "A1"  # Saved as the size of the sheet
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, "responses.xlsx")
+    ...     wb.save(path)
+    ...     rows = list(iter_excel(path))
+    >>> rows
+    [('Name', 'Class'), ('Ann', '3A')]
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(excel_file, read_only=True)
+    try:
+        sheet = wb.active
+        sheet.reset_dimensions()
+        for row in sheet.iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def load_survey(survey_file, datatypes=None, columns=None, chunk_size=CHUNK_SIZE):
+    """Loads a survey file, parsing it only once
+
+    The first time a question of a survey file is loaded, it is parsed
+    and saved in a folder of columns next to the survey file, along with
+    any questions saved before. Afterwards, the columns are memory-mapped
+    from that folder instead of parsing the file again.
+
+    Args:
+        survey_file(str): The file name of the excel/csv file to be loaded
+        datatypes(dict): The datatypes of the responses mapped to question
+            number. Numerical questions are converted to typed arrays.
+        columns(iterable): The numbers of the questions to load. Defaults
+            to every question.
+        chunk_size(int): The number of rows of a csv file to read at a time
+
+    Returns:
+        A Survey mapping the question to a column of responses
+    """
+    folder = columns_folder(survey_file)
+    try:
+        if os.path.getmtime(folder) < os.path.getmtime(survey_file):
+            raise OSError(f"{folder} is older than {survey_file}")
+        survey = Survey.load(folder)
+    except (OSError, ValueError, KeyError):
+        survey = None
+
+    parsed = columns
+    if survey is not None:
+        saved = set(survey.numbers.values())
+        numbers = range(1, len(survey.headers) + 1)
+        if not saved.issuperset(numbers if columns is None else set(columns).intersection(numbers)):
+            # Parse the saved questions again too, so that they stay saved
+            parsed = None if columns is None else saved.union(columns)
+            survey = None
+    metrics.lookup("columns", hits=int(survey is not None), misses=int(survey is None))
+    if survey is None:
+        with metrics.timed("parse_survey"):
+            survey = parse_survey(survey_file, parsed, chunk_size=chunk_size)
+        save_columns(survey, folder)
+    if columns is not None:
+        survey = survey.select(columns)
+    return survey.typed(datatypes) if datatypes else survey
+
+
+def parse_survey(survey_file, columns=None, header_only=False, chunk_size=CHUNK_SIZE):
+    """Parses an excel/csv survey file, see parse_excel() and parse_csv()"""
+    if survey_file.endswith(".csv"):
+        return parse_csv(survey_file, columns=columns, header_only=header_only, chunk_size=chunk_size)
+    return parse_excel(survey_file, columns=columns, header_only=header_only)
+
+
+def list_questions(survey_file):
+    """Lists the questions of a survey file
+
+    Only the manifest of the saved columns, or else the first row of the
+    survey file, is read.
+
+    Args:
+        survey_file(str): The file name of the excel/csv file
+
+    Returns:
+        A list of the questions in the survey
+    """
+    try:
+        return read_manifest(columns_folder(survey_file))["headers"]
+    except (OSError, ValueError, KeyError):
+        return parse_survey(survey_file, header_only=True)
+
+
+def read_errors():
+    """Returns the exceptions raised when a survey file can not be read
+
+    Such as a missing question, or a file that is not an Excel/CSV file or
+    not encoded in UTF-8. openpyxl is only imported once one is raised.
+    """
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    return KeyError, OSError, UnicodeDecodeError, zipfile.BadZipFile, InvalidFileException
+
+
+def columns_folder(survey_file):
+    """Returns the folder that the columns of survey_file are saved in"""
+    return f"{survey_file}.columns"
+
+
+def save_columns(survey, directory):
+    """Saves the columns of a survey, ignoring failures as they are only a cache"""
+    temp = f"{directory}.{secure(8)}"
+    try:
+        survey.save(temp)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(temp, directory)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
 
 
 def parse_config(config_file):
@@ -156,7 +368,7 @@ def parse_config(config_file):
         lines = [line.split(" ") for line in lines]
         accepted = ("ignore", "numerical", "categorical", "openended", "multicategorical")
         for i in lines:
-            if not i[0].isdigit() or i[1] not in accepted:
+            if len(i) < 2 or not i[0].isdigit() or i[1] not in accepted:
                 raise TypeError(
                     f"Line'{i}': parse_config only accepts lines with format <qn_no> <qn_type>"
                 )
@@ -184,23 +396,174 @@ def to_config(directory, config):
     return file_path
 
 
+def file_crc(path, block_size=1024 ** 2):
+    """Returns the CRC-32 of a file, reading it one block at a time"""
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            crc = crc32(block, crc)
+    return crc
+
+
+def stream_zip(paths, block_size=1024 ** 2):
+    """Streams a ZIP archive of files
+
+    The archive is yielded as it is written, one block of a file at a
+    time, so it is never held in memory or written to disk. The files are
+    stored without compression, as the images and reports of an analysis
+    are already compressed. Every file is read once more beforehand for
+    its CRC, so that its local header is complete. Otherwise it would be
+    followed by a data descriptor, which some streaming readers, such as
+    java.util.zip.ZipInputStream, reject for stored files. Files and the
+    archive must be smaller than 4 GiB.
+
+    Args:
+        paths(list): paths to the files to archive, which are archived
+            under their file name
+        block_size(int): number of bytes of a file to read at a time
+
+    Yields:
+        The bytes of the archive
+
+    >>> import io, os, tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, "report.txt")
+    ...     with open(path, "w") as f:
+    ...         _ = f.write("Hello")
+    ...     archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip([path]))))
+    >>> archive.read("report.txt"), archive.infolist()[0].flag_bits
+    (b'Hello', 0)
+    """
+    offset, directory = 0, []
+    for path in paths:
+        info = zipfile.ZipInfo.from_file(path, os.path.basename(path))
+        info.CRC, info.compress_size, info.header_offset = file_crc(path, block_size), info.file_size, offset
+        header = info.FileHeader(zip64=False)
+        yield header
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                yield block
+        offset += len(header) + info.file_size
+        # The central directory repeats the fields of the local header from
+        # its version to the length of its name, and the name itself
+        name_length = struct.unpack("<H", header[26:28])[0]
+        directory.append(
+            b"PK\x01\x02"
+            + struct.pack("<H", info.create_version | info.create_system << 8)
+            + header[4:28]
+            + struct.pack("<4HLL", 0, 0, 0, 0, info.external_attr, info.header_offset)
+            + header[30:30 + name_length]
+        )
+    central = b"".join(directory)
+    yield central + struct.pack("<4s4HLLH", b"PK\x05\x06", 0, 0, len(directory), len(directory), len(central), offset, 0)
+
+
 # Prediction
 class Predictor(object):
-    """TextBlob classifier that predicts if qn is either
-    categorical, numerical, or openended.
+    """Classifier that predicts if qn is either
+    categorical, numerical, openended or ignored.
+
+    The compact classifier from classifier.py is loaded from a .npz file,
+    while a .pickle file still loads the original TextBlob classifier.
+    Predictions are memoised in a bounded LRU cache, as the same
+    questions tend to be uploaded again and again.
     """
 
-    def __init__(self):
-        """Loads pre-trained TextBlob classifier."""
-        with open("model.pickle", "rb") as pick:
-            self.classifier = pickle.load(pick)
+    def __init__(self, model=MODEL, cache_size=1024):
+        """Loads pre-trained classifier."""
+        if model.endswith(".npz"):
+            self.classifier = Classifier.load(model)
+        else:
+            with open(model, "rb") as pick:
+                self.classifier = pickle.load(pick)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def classify(self, qns):
+        """Classifies qns without going through the cache."""
+        if hasattr(self.classifier, "classify_many"):
+            return self.classifier.classify_many(qns)
+        return [self.classifier.classify(qn) for qn in qns]
 
     def predict(self, qns):
-        """Predicts if qns in qns are either categorical, numerical, or openended."""
-        return [self.classifier.classify(qn) for qn in qns]
+        """Predicts if qns in qns are either categorical, numerical, openended or ignored."""
+        predictions = {}
+        with self._lock:
+            for qn in qns:
+                if qn in self._cache:
+                    self._cache.move_to_end(qn)
+                    predictions[qn] = self._cache[qn]
+        missing = list(dict.fromkeys(qn for qn in qns if qn not in predictions))
+        metrics.lookup("predictor", hits=len(predictions), misses=len(missing))
+        if missing:
+            with metrics.timed("predict"):
+                predictions.update(zip(missing, self.classify(missing)))
+            with self._lock:
+                for qn in missing:
+                    self._cache[qn] = predictions[qn]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [predictions[qn] for qn in qns]
+
+
+_predictor = None
+_predictor_lock = Lock()
+
+
+def get_predictor():
+    """Returns the predictor shared by the whole process
+
+    The model is only loaded the first time this is called.
+
+    Returns:
+        The shared instance of Predictor
+    """
+    global _predictor
+    if _predictor is None:
+        with _predictor_lock:
+            if _predictor is None:
+                _predictor = Predictor()
+    return _predictor
 
 
 # Plotting
+def pie_spec(title, labels, values, hole=0.4):
+    """Creates the spec of a pie chart
+
+    Parses data passed in and creates a plotly.js spec of a pie chart,
+    which is rendered client-side by analysis.html.
+
+    Args:
+        title(str): Title of the pie chart
+        labels(list): Labels of each slice in the pie chart
+        values(list): Value of each slice
+        hole(float): Size of the hole in the pie chart
+
+    Returns:
+        A dictionary containing the data and layout of the pie chart
+
+    >>> pie_spec("Do you like python?", ["No", "Yes"], [0.25, 0.75])["data"][0]["values"]
+    [0.25, 0.75]
+    """
+    return {
+        "data": [
+            {
+                "type": "pie",
+                "labels": list(labels),
+                "values": list(values),
+                "hole": hole,
+                "hoverinfo": "label+percent",
+                "text": list(labels),
+                "marker": {"colors": COLORS, "line": {"color": "#FFFFFF", "width": 2}},
+                "sort": False,
+                "showlegend": False,
+            }
+        ],
+        "layout": {"font": {"family": "Nunito", "size": 18, "color": "#858796"}},
+    }
+
+
 def pie(title, labels, values, hole=0.4):
     """Creates a pie chart
 
@@ -215,43 +578,34 @@ def pie(title, labels, values, hole=0.4):
     Returns:
         HTML div of the pie chart
     """
-    fig = plotly.graph_objs.Figure(
-        data=[
-            plotly.graph_objs.Pie(
-                labels=labels,
-                values=values,
-                hole=hole,
-                hoverinfo="label+percent",
-                text=labels,
-                marker=dict(colors=COLORS, line=dict(color="#FFFFFF", width=2)),
-                sort=False,
-                showlegend=False,
-            )
-        ]
-    )
-
-    fig.layout.font = dict(family="Nunito", size=18, color="#858796")
+    import plotly.graph_objs
+    import plotly.offline
+    from flask import Markup
 
+    fig = plotly.graph_objs.Figure(pie_spec(title, labels, values, hole))
     return Markup(plotly.offline.plot(fig, include_plotlyjs=False, output_type="div"))
 
 
 def chunk(iterable, size):
     """Splits iterable into chunks
 
-    Splits iterable into multiple chunks
+    Splits iterable into multiple chunks. Iterators are consumed
+    lazily, one chunk at a time.
 
     Args:
         iterable(iterable): Iterable to be split
         size(int): Size of each chunk
 
-    Yields:
-        One chunk
+    Returns:
+        An iterator over the chunks, as lists
 
     >>> list(chunk([1, 2, 3, 4], 2))
     [[1, 2], [3, 4]]
+    >>> list(chunk(iter(range(5)), 2))
+    [[0, 1], [2, 3], [4]]
     """
-    for i in range(0, len(iterable), size):
-        yield iterable[i: (i + size)]
+    iterator = iter(iterable)
+    return iter(lambda: list(islice(iterator, size)), [])
 
 
 def random_colour(word, font_size, position, orientation, font_path, random_state):